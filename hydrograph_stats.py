@@ -3,21 +3,33 @@
 from dataclasses import dataclass
 import resource
 import fsspec
+import fsspec.core
+import numpy as np
 import pandas as pd
 from redis import Redis
 import requests
 import yaml
 
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
 from dataclasses import field
+from datetime import timedelta, timezone
 from dateutil import tz
+from fnmatch import fnmatch
+import hashlib
 from io import StringIO
 import json
+import multiprocessing
 import os
 from os import PathLike
 import sys
-from typing import List, Optional, Tuple, Union
-from urllib.parse import urlparse
+import threading
+import time
+import traceback
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote, urlparse
 from pydsstools.heclib.dss import HecDss
 import tempfile
 
@@ -37,11 +49,76 @@ DEFAULT_DSS = False
 DEFAULT_PRETTY_PRINT = False
 DEFAULT_OUT = None
 DEFAULT_OUT_FSSPEC_KWARGS = None
+DEFAULT_LISTING_CACHE = None
+DEFAULT_LISTING_CACHE_TTL = None
+DEFAULT_LISTING_WORKERS = 16
+DEFAULT_CHECKPOINT = None
+DEFAULT_CHECKPOINT_EVERY = 100
+DEFAULT_RESUME = False
+DEFAULT_STATS = []
+DEFAULT_EXCEEDANCE_PERCENTS = [10, 50, 90]
+DEFAULT_THRESHOLD = None
+DEFAULT_POT_THRESHOLD = None
+DEFAULT_POT_MIN_SEPARATION = '5D'
+DEFAULT_POT_MIN_DROP_RATIO = None
+DEFAULT_GROUP_BY = None
+DEFAULT_SEASONS = None
+DEFAULT_JSONL = False
+DEFAULT_QC = False
+DEFAULT_MAX_GAP = None
+DEFAULT_PARSED_CACHE = None
+DEFAULT_MAX_WORKERS = 1
+DEFAULT_MEMORY_BUDGET = None
+DEFAULT_MEMORY_FACTOR = 10.0
+DEFAULT_AGGREGATE_OUT = None
+DEFAULT_AGGREGATE_INPUTS = []
+DEFAULT_AGGREGATE_PERCENTS = [5, 25, 50, 75, 95]
+DEFAULT_SKETCH_COMPRESSION = 200
+DEFAULT_PARSE_WORKERS = 1
+DEFAULT_PARSE_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_USGS_ALL_SERIES = False
+# share of the container memory limit used as the default budget
+MEMORY_BUDGET_FRACTION = 0.8
+# hydrographs submitted ahead of the one being collected, per worker
+SUBMIT_WINDOW_FACTOR = 2
+CGROUP_MEMORY_LIMIT_PATHS = [
+    '/sys/fs/cgroup/memory.max',  # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroup v1
+]
+
+PARSED_CACHE_VERSION = 1
+
+# values buffered per compression unit before a sketch is compressed
+SKETCH_BUFFER_FACTOR = 10
+# result fields that aren't aggregated across hydrographs
+AGGREGATE_SKIP_FIELDS = ['duration', 'hydrograph', 'series', 'block', 'qc', 'events', 'threshold']
+
+GROUP_BY_OPTIONS = ['calendar_year', 'water_year', 'month', 'season']
+WATER_YEAR_START_MONTH = 10
+METEOROLOGICAL_SEASONS = {
+    'winter': [12, 1, 2],
+    'spring': [3, 4, 5],
+    'summer': [6, 7, 8],
+    'fall': [9, 10, 11],
+}
+
+EXTRA_STATS = [
+    'volume',
+    'time_to_peak',
+    'rising_limb_duration',
+    'falling_limb_duration',
+    'exceedance',
+    'threshold_duration',
+]
+
+GLOB_MAGIC_CHARS = '*?['
 
 USGS_SEP = '\t'
 USGS_COL_DATETIME = 'datetime'
 USGS_COL_FLOW_ENDSWITH = '00060'
 USGS_COL_TZ = 'tz_cd'
+USGS_DATETIME_FORMAT = '%Y-%m-%d %H:%M'
+USGS_DATE_FORMAT = '%Y-%m-%d'
 USGS_TZ_MAPPINGS = {
     'EST': 'America/New_York',
     'EDT': 'America/New_York',
@@ -58,9 +135,34 @@ USGS_TZ_MAPPINGS = {
     'AST': 'America/Puerto_Rico',
 }
 
+# hours from UTC
+USGS_TZ_OFFSETS = {
+    'EST': -5,
+    'EDT': -4,
+    'CST': -6,
+    'CDT': -5,
+    'MST': -7,
+    'MDT': -6,
+    'PST': -8,
+    'PDT': -7,
+    'HST': -10,
+    'HDT': -9,
+    'AKST': -9,
+    'AKDT': -8,
+    'AST': -4,
+}
+
 DSS_COL_DATETIME = 'datetime'
 DSS_COL_FLOW = 'flow'
 
+DATA_COL_DATETIME = 'datetime'
+DATA_COL_FLOW = 'flow'
+# a DataFrame, a Series indexed by datetime, or a (datetimes, flows) pair
+HydrographData = Union[pd.DataFrame, pd.Series, Tuple[Sequence, Sequence]]
+
+HYDROGRAPH_STATS_FIELDS = ['max', 'max_datetime', 'min', 'min_datetime', 'avg', 'duration',
+                           'duration_max', 'duration_max_datetime', 'duration_min', 'duration_min_datetime']
+
 
 def hydrograph_max(df: pd.DataFrame, col_datetime: str, col_flow: str) -> Tuple[float, pd.Timestamp]:
     max_idx = df[col_flow].idxmax()
@@ -76,55 +178,640 @@ def hydrograph_min(df: pd.DataFrame, col_datetime: str, col_flow: str) -> Tuple[
     return min_flow, min_datetime
 
 
-def analyze_hydrograph(df: pd.DataFrame, col_datetime: str, col_flow: str, duration: str) -> dict:
+def datetime_seconds(s: pd.Series) -> np.ndarray:
+    # seconds since the first timestamp; tz-aware values are compared in UTC
+    ns = pd.to_datetime(s).values.astype('datetime64[ns]').astype(np.int64)
+    return (ns - ns[0]) / 1e9
+
+
+def hydrograph_volume(seconds: np.ndarray, flow: np.ndarray) -> float:
+    # trapezoidal integration honors irregular spacing
+    valid = ~np.isnan(flow)
+    return float(np.trapz(flow[valid], seconds[valid]))
+
+
+def hydrograph_limbs(seconds: np.ndarray, flow: np.ndarray) -> Tuple[float, float, float]:
+    if np.isnan(flow).all():
+        raise ValueError('Limb durations require at least one valid flow.')
+    peak_idx = int(np.nanargmax(flow))
+    # The rising limb starts at the lowest flow before the peak and the
+    # falling limb ends at the lowest flow after it. Local minima would stop
+    # at the small dips measured records have on either side of a peak.
+    rise_idx = peak_idx - int(np.nanargmin(flow[peak_idx::-1]))
+    fall_idx = peak_idx + int(np.nanargmin(flow[peak_idx:]))
+    time_to_peak = seconds[peak_idx] - seconds[0]
+    rising = seconds[peak_idx] - seconds[rise_idx]
+    falling = seconds[fall_idx] - seconds[peak_idx]
+    return float(time_to_peak), float(rising), float(falling)
+
+
+def flow_exceedance(flow: np.ndarray, percents: List[float]) -> dict:
+    # Q10 is the flow exceeded 10% of the time, i.e. the 90th percentile.
+    # Partitioning around the needed ranks avoids a full sort.
+    values = flow[~np.isnan(flow)]
+    if not len(values):
+        raise ValueError('Exceedance flows require at least one valid flow.')
+    positions = [(1 - p / 100) * (len(values) - 1) for p in percents]
+    kth = sorted({int(np.floor(x)) for x in positions} |
+                 {int(np.ceil(x)) for x in positions})
+    partitioned = np.partition(values, kth)
+    exceedance = {}
+    for p, x in zip(percents, positions):
+        lo, hi = int(np.floor(x)), int(np.ceil(x))
+        exceedance[f'q{p:g}'] = float(
+            partitioned[lo] + (partitioned[hi] - partitioned[lo]) * (x - lo))
+    return exceedance
+
+
+def threshold_duration(seconds: np.ndarray, flow: np.ndarray, threshold: float) -> float:
+    # time above the threshold, interpolating linearly where an interval
+    # crosses it
+    a = flow[:-1] - threshold
+    b = flow[1:] - threshold
+    fraction = ((a > 0) & (b > 0)).astype(float)
+    crossing = (a > 0) != (b > 0)
+    fraction[crossing] = np.maximum(a, b)[crossing] / \
+        np.abs(a - b)[crossing]
+    return float(np.nansum(fraction * np.diff(seconds)))
+
+
+def hydrograph_extra_stats(datetimes: pd.Series, flows: pd.Series, stats: List[str],
+                           exceedance_percents: List[float] = DEFAULT_EXCEEDANCE_PERCENTS,
+                           threshold: Optional[float] = DEFAULT_THRESHOLD) -> dict:
+    unknown = [name for name in stats if name not in EXTRA_STATS]
+    if unknown:
+        raise ValueError(f'Unknown stats: {unknown}. Options: {EXTRA_STATS}')
+    seconds = datetime_seconds(datetimes)
+    flow = flows.to_numpy(dtype=float)
+    result = {}
+    if {'time_to_peak', 'rising_limb_duration', 'falling_limb_duration'} & set(stats):
+        time_to_peak, rising, falling = hydrograph_limbs(seconds, flow)
+    for name in stats:
+        if name == 'volume':
+            result['volume'] = hydrograph_volume(seconds, flow)
+        elif name == 'time_to_peak':
+            result['time_to_peak'] = time_to_peak
+        elif name == 'rising_limb_duration':
+            result['rising_limb_duration'] = rising
+        elif name == 'falling_limb_duration':
+            result['falling_limb_duration'] = falling
+        elif name == 'exceedance':
+            result.update(flow_exceedance(flow, exceedance_percents))
+        elif name == 'threshold_duration':
+            if threshold is None:
+                raise ValueError('threshold_duration requires a threshold.')
+            result['threshold'] = threshold
+            result['threshold_duration'] = threshold_duration(
+                seconds, flow, threshold)
+    return result
+
+
+def hydrograph_rolling_mean(df: pd.DataFrame, col_datetime: str, col_flow: str, duration: str,
+                            max_gap: Optional[str] = DEFAULT_MAX_GAP) -> pd.DataFrame:
+    df_dt_q = df[[col_datetime, col_flow]]
+    df_rolling = df_dt_q.rolling(window=duration, on=col_datetime).mean()
+    if max_gap is not None:
+        # A window (t - duration, t] overlaps the interval ending at t_k
+        # exactly when it contains t_k, so a rolling count of gap ends flags
+        # the windows that span a gap.
+        gap_ends = pd.DataFrame({
+            col_datetime: df[col_datetime],
+            'gap': (df[col_datetime].diff() > pd.Timedelta(max_gap)).astype(float),
+        })
+        spans_gap = gap_ends.rolling(
+            window=duration, on=col_datetime)['gap'].sum() > 0
+        # windows reaching back before the first timestamp are partial too
+        partial = datetime_seconds(
+            df[col_datetime]) < pd.Timedelta(duration).total_seconds()
+        df_rolling.loc[spans_gap.to_numpy() | partial, col_flow] = np.nan
+    return df_rolling
+
+
+def screen_hydrograph(df: pd.DataFrame, col_datetime: str, col_flow: str,
+                      max_gap: Optional[str] = DEFAULT_MAX_GAP) -> Tuple[pd.DataFrame, dict]:
+    flow = df[col_flow]
+    # qualification codes such as Ice or Eqp become NaN and are counted
+    numeric = pd.to_numeric(flow, errors='coerce')
+    codes = flow[numeric.isna() & flow.notna()]
+    datetimes = df[col_datetime]
+    valid = (numeric.notna() & datetimes.notna()).to_numpy()
+    screened = pd.DataFrame({col_datetime: datetimes, col_flow: numeric})
+    if not valid.all():
+        screened = screened[valid]
+    ns = screened[col_datetime].values.astype(
+        'datetime64[ns]').astype(np.int64)
+    intervals = np.diff(ns)
+    unsorted = bool((intervals < 0).any())
+    if unsorted:
+        order = np.argsort(ns, kind='stable')
+        screened = screened.iloc[order]
+        intervals = np.diff(ns[order])
+    # Once sorted, duplicates are adjacent, e.g. repeated local times around
+    # the DST fall-back. The first is kept.
+    duplicated = np.zeros(len(ns), dtype=bool)
+    duplicated[1:] = intervals == 0
+    screened = screened[~duplicated].reset_index(drop=True)
+    intervals = intervals[intervals > 0] / 1e9
+    qc = {
+        'rows': len(df),
+        'missing': int(flow.isna().sum()),
+        'missing_datetime': int(datetimes.isna().sum()),
+        'non_numeric': {str(k): int(v) for k, v in codes.astype(str).value_counts().items()},
+        'unsorted': unsorted,
+        'duplicates': int(duplicated.sum()),
+        'largest_gap': float(intervals.max()) if len(intervals) else None,
+    }
+    if max_gap is not None:
+        qc['max_gap'] = max_gap
+        qc['gaps'] = int(
+            (intervals > pd.Timedelta(max_gap).total_seconds()).sum())
+    return screened, qc
+
+
+def analyze_hydrograph(df: pd.DataFrame, col_datetime: str, col_flow: str, duration: str,
+                       stats: Optional[List[str]] = None,
+                       exceedance_percents: List[float] = DEFAULT_EXCEEDANCE_PERCENTS,
+                       threshold: Optional[float] = DEFAULT_THRESHOLD,
+                       max_gap: Optional[str] = DEFAULT_MAX_GAP) -> dict:
     max_flow, max_datetime = hydrograph_max(df, col_datetime, col_flow)
     min_flow, min_datetime = hydrograph_min(df, col_datetime, col_flow)
     avg = df[col_flow].mean()
 
-    df_dt_q = df[[col_datetime, col_flow]]
-    df_rolling = df_dt_q.rolling(window=duration, on=col_datetime).mean()
-    duration_max, duration_max_datetime = hydrograph_max(
-        df_rolling, col_datetime, col_flow)
-    duration_min, duration_min_datetime = hydrograph_min(
-        df_rolling, col_datetime, col_flow)
+    df_rolling = hydrograph_rolling_mean(
+        df, col_datetime, col_flow, duration, max_gap)
 
-    return {
+    result = {
         'max': max_flow,
         'max_datetime': max_datetime.isoformat(),
         'min': min_flow,
         'min_datetime': min_datetime.isoformat(),
         'avg': avg,
         'duration': duration,
-        'duration_max': duration_max,
-        'duration_max_datetime': duration_max_datetime.isoformat(),
-        'duration_min': duration_min,
-        'duration_min_datetime': duration_min_datetime.isoformat(),
+        'duration_max': None,
+        'duration_max_datetime': None,
+        'duration_min': None,
+        'duration_min_datetime': None,
     }
+    # with max_gap, every window of a sparse hydrograph may be left out
+    if df_rolling[col_flow].notna().any():
+        duration_max, duration_max_datetime = hydrograph_max(
+            df_rolling, col_datetime, col_flow)
+        duration_min, duration_min_datetime = hydrograph_min(
+            df_rolling, col_datetime, col_flow)
+        result.update({
+            'duration_max': duration_max,
+            'duration_max_datetime': duration_max_datetime.isoformat(),
+            'duration_min': duration_min,
+            'duration_min_datetime': duration_min_datetime.isoformat(),
+        })
+    if stats:
+        result.update(hydrograph_extra_stats(
+            df[col_datetime], df[col_flow], stats, exceedance_percents, threshold))
+    return result
+
+
+def rolling_max(ns: np.ndarray, flow: np.ndarray, window: str) -> np.ndarray:
+    s = pd.Series(flow, index=pd.to_datetime(ns))
+    return s.rolling(window).max().to_numpy()
+
+
+def peaks_over_threshold(ns: np.ndarray, flow: np.ndarray, threshold: float,
+                         min_separation: str = DEFAULT_POT_MIN_SEPARATION,
+                         min_drop_ratio: Optional[float] = DEFAULT_POT_MIN_DROP_RATIO) -> List[int]:
+    separation_ns = pd.Timedelta(min_separation).value
+    # Candidate peaks are the largest flow within min_separation on either
+    # side: a trailing rolling max over time, and the same over the mirrored
+    # series for the leading side.
+    trailing = rolling_max(ns, flow, min_separation)
+    leading = rolling_max(
+        (ns[-1] - ns)[::-1], flow[::-1], min_separation)[::-1]
+    candidates = np.flatnonzero(
+        (flow > threshold) & (flow >= trailing) & (flow >= leading))
+
+    def dependent(prev: int, idx: int) -> bool:
+        # equal flows can both be window maxima within the separation
+        if ns[idx] - ns[prev] < separation_ns:
+            return True
+        if min_drop_ratio is not None:
+            trough = np.nanmin(flow[prev:idx + 1])
+            return trough >= min_drop_ratio * min(flow[prev], flow[idx])
+        return False
+
+    # Declustering only loops over candidates, which are at most one per
+    # separation window.
+    peaks = []
+    for idx in candidates:
+        while peaks and dependent(peaks[-1], idx):
+            if flow[idx] > flow[peaks[-1]]:
+                peaks.pop()
+            else:
+                break
+        else:
+            peaks.append(idx)
+    return peaks
+
+
+def hydrograph_peaks_over_threshold(df: pd.DataFrame, col_datetime: str, col_flow: str, threshold: float,
+                                    min_separation: str = DEFAULT_POT_MIN_SEPARATION,
+                                    min_drop_ratio: Optional[float] = DEFAULT_POT_MIN_DROP_RATIO) -> List[dict]:
+    ns = pd.to_datetime(df[col_datetime]).values.astype(
+        'datetime64[ns]').astype(np.int64)
+    flow = df[col_flow].to_numpy(dtype=float)
+    peaks = peaks_over_threshold(
+        ns, flow, threshold, min_separation, min_drop_ratio)
+    datetimes = df[col_datetime]
+    return [{'peak': float(flow[idx]), 'peak_datetime': datetimes.iloc[idx].isoformat()}
+            for idx in peaks]
+
+
+def season_start_month(months: List[int]) -> int:
+    # the month whose predecessor isn't in the season, wherever it's listed
+    starts = [m for m in months if (m - 2) % 12 + 1 not in months]
+    if len(starts) > 1:
+        raise ValueError(f'Season months must be consecutive: {months}')
+    # a season of all twelve months runs with the calendar year
+    return starts[0] if starts else 1
+
+
+def block_keys(datetimes: pd.Series, group_by: str, seasons: Optional[dict] = None) -> np.ndarray:
+    dt = pd.to_datetime(datetimes).dt
+    year = dt.year.to_numpy()
+    month = dt.month.to_numpy()
+    if group_by == 'calendar_year':
+        return year
+    elif group_by == 'water_year':
+        # water years are named for the calendar year they end in
+        return year + (month >= WATER_YEAR_START_MONTH)
+    elif group_by == 'month':
+        return year * 100 + month
+    elif group_by == 'season':
+        seasons = METEOROLOGICAL_SEASONS if seasons is None else seasons
+        season_idx = np.full(13, -1)
+        first_month = np.zeros(13, dtype=int)
+        for i, months in enumerate(seasons.values()):
+            season_idx[months] = i
+            first_month[months] = season_start_month(months)
+        idx = season_idx[month]
+        # seasons spanning new year (e.g. Dec-Feb) belong to the year they start in
+        keys = (year - (month < first_month[month])) * 100 + idx
+        # months outside every season are left out
+        return np.where(idx >= 0, keys, -1)
+    raise ValueError(
+        f'Unknown group_by: {group_by}. Options: {GROUP_BY_OPTIONS}')
+
+
+def block_label(key: int, group_by: str, seasons: Optional[dict] = None) -> str:
+    if group_by == 'month':
+        return f'{key // 100}-{key % 100:02d}'
+    elif group_by == 'season':
+        seasons = METEOROLOGICAL_SEASONS if seasons is None else seasons
+        return f'{key // 100}-{list(seasons)[key % 100]}'
+    return str(key)
+
+
+def analyze_hydrograph_blocks(df: pd.DataFrame, col_datetime: str, col_flow: str, duration: str,
+                              group_by: str, seasons: Optional[dict] = None,
+                              stats: Optional[List[str]] = None,
+                              exceedance_percents: List[float] = DEFAULT_EXCEEDANCE_PERCENTS,
+                              threshold: Optional[float] = DEFAULT_THRESHOLD,
+                              max_gap: Optional[str] = DEFAULT_MAX_GAP) -> List[dict]:
+    datetimes = df[col_datetime]
+    flows = df[col_flow]
+    # Rolling windows run over the whole series, so a window spanning a block
+    # boundary averages the real preceding flows instead of restarting at
+    # the block start. Each window belongs to the block it ends in.
+    df_rolling = hydrograph_rolling_mean(
+        df, col_datetime, col_flow, duration, max_gap)
+    frame = pd.DataFrame({
+        'key': block_keys(datetimes, group_by, seasons),
+        'flow': flows.to_numpy(),
+        'rolling': df_rolling[col_flow].to_numpy(),
+    })
+    grouped = frame.groupby('key')
+    agg = grouped.agg(
+        max_idx=('flow', 'idxmax'),
+        min_idx=('flow', 'idxmin'),
+        avg=('flow', 'mean'),
+        duration_max_idx=('rolling', 'idxmax'),
+        duration_min_idx=('rolling', 'idxmin'),
+    )
+    rolling = frame['rolling']
+    results = []
+    for key, row in zip(agg.index, agg.itertuples(index=False)):
+        if key < 0:
+            continue
+        result = {
+            'block': block_label(key, group_by, seasons),
+            'max': float(flows.iloc[row.max_idx]),
+            'max_datetime': datetimes.iloc[row.max_idx].isoformat(),
+            'min': float(flows.iloc[row.min_idx]),
+            'min_datetime': datetimes.iloc[row.min_idx].isoformat(),
+            'avg': row.avg,
+            'duration': duration,
+            'duration_max': None,
+            'duration_max_datetime': None,
+            'duration_min': None,
+            'duration_min_datetime': None,
+        }
+        # with max_gap, every window of a sparse block may be left out
+        if not pd.isna(row.duration_max_idx):
+            result.update({
+                'duration_max': rolling.iloc[int(row.duration_max_idx)],
+                'duration_max_datetime': datetimes.iloc[int(row.duration_max_idx)].isoformat(),
+                'duration_min': rolling.iloc[int(row.duration_min_idx)],
+                'duration_min_datetime': datetimes.iloc[int(row.duration_min_idx)].isoformat(),
+            })
+        if stats:
+            idx = grouped.indices[key]
+            result.update(hydrograph_extra_stats(
+                datetimes.iloc[idx], flows.iloc[idx], stats, exceedance_percents, threshold))
+        results.append(result)
+    return results
+
+
+class QuantileSketch:
+    """Mergeable t-digest (merging variant) for approximate quantiles in bounded memory."""
+
+    def __init__(self, compression: float = DEFAULT_SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+
+    def add(self, value: float):
+        value = float(value)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self._buffer.append(value)
+        if len(self._buffer) >= SKETCH_BUFFER_FACTOR * self.compression:
+            self._compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        other._compress()
+        self._compress(other.means, other.weights)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _compress(self, means: Optional[np.ndarray] = None, weights: Optional[np.ndarray] = None):
+        buffer = np.array(self._buffer)
+        self._buffer = []
+        if means is None:
+            if not len(buffer):
+                return
+            means, weights = np.empty(0), np.empty(0)
+        means = np.concatenate([self.means, means, buffer])
+        weights = np.concatenate([self.weights, weights, np.ones(len(buffer))])
+        if not len(means):
+            return
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        # k1 scale function: centroids are small near the tails, where
+        # quantile estimates need the most resolution
+        def k(q): return self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        def k_inverse(k): return (np.sin(2 * np.pi * k / self.compression) + 1) / 2
+        merged_means = [means[0]]
+        merged_weights = [weights[0]]
+        cumulative = 0.0
+        limit = total * k_inverse(k(0.0) + 1)
+        for mean, weight in zip(means[1:], weights[1:]):
+            if cumulative + merged_weights[-1] + weight <= limit:
+                merged_weights[-1] += weight
+                merged_means[-1] += (mean - merged_means[-1]) * \
+                    weight / merged_weights[-1]
+            else:
+                cumulative += merged_weights[-1]
+                limit = total * k_inverse(k(cumulative / total) + 1)
+                merged_means.append(mean)
+                merged_weights.append(weight)
+        self.means = np.array(merged_means)
+        self.weights = np.array(merged_weights)
+
+    def quantile(self, q: float) -> float:
+        self._compress()
+        if not len(self.means):
+            return float('nan')
+        centers = np.cumsum(self.weights) - self.weights / 2
+        total = self.weights.sum()
+        return float(np.interp(q * total, np.concatenate([[0], centers, [total]]),
+                               np.concatenate([[self.min], self.means, [self.max]])))
+
+    def to_dict(self) -> dict:
+        self._compress()
+        return {
+            'compression': self.compression,
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+            'min': self.min,
+            'max': self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'QuantileSketch':
+        sketch = cls(d['compression'])
+        sketch.means = np.array(d['means'], dtype=float)
+        sketch.weights = np.array(d['weights'], dtype=float)
+        sketch.min = d['min']
+        sketch.max = d['max']
+        return sketch
+
+
+class StatSummary:
+    """Count, mean, variance, extremes and a quantile sketch of one stat, mergeable across shards."""
+
+    def __init__(self, is_datetime: bool = False, compression: float = DEFAULT_SKETCH_COMPRESSION):
+        self.is_datetime = is_datetime
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch(compression)
+
+    def add(self, value: float):
+        # Welford's update
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    def merge(self, other: 'StatSummary'):
+        # Chan et al.'s pairwise update
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.sketch.merge(other.sketch)
+
+    def summary(self, percents: List[float]) -> dict:
+        # datetimes are summarized as epoch seconds and reported in UTC
+        def value(x):
+            if self.is_datetime:
+                return pd.Timestamp(x, unit='s', tz='UTC').isoformat()
+            return x
+        std = float(np.sqrt(self.m2 / (self.count - 1))
+                    ) if self.count > 1 else 0.0
+        return {
+            'count': self.count,
+            'mean': value(self.mean),
+            # seconds for datetimes
+            'std': std,
+            'min': value(self.sketch.min),
+            'max': value(self.sketch.max),
+            'percentiles': {f'p{p:g}': value(self.sketch.quantile(p / 100)) for p in percents},
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            'is_datetime': self.is_datetime,
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'sketch': self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'StatSummary':
+        summary = cls(d['is_datetime'])
+        summary.count = d['count']
+        summary.mean = d['mean']
+        summary.m2 = d['m2']
+        summary.sketch = QuantileSketch.from_dict(d['sketch'])
+        return summary
+
+
+class EnsembleAggregate:
+    """Per-stat summaries across the results of many hydrographs."""
+
+    def __init__(self, compression: float = DEFAULT_SKETCH_COMPRESSION):
+        self.compression = compression
+        self.hydrographs = 0
+        self.stats = {}
+
+    def _stat(self, name: str, is_datetime: bool) -> StatSummary:
+        if name not in self.stats:
+            self.stats[name] = StatSummary(is_datetime, self.compression)
+        return self.stats[name]
+
+    def add(self, result: dict):
+        for name, value in result.items():
+            if name in AGGREGATE_SKIP_FIELDS or value is None:
+                continue
+            if name.endswith('_datetime'):
+                self._stat(name, True).add(
+                    pd.Timestamp(value).timestamp())
+            else:
+                self._stat(name, False).add(float(value))
+        if 'events' in result:
+            self._stat('event_count', False).add(len(result['events']))
+
+    def add_hydrograph(self, results: List[dict]):
+        self.hydrographs += 1
+        for result in results:
+            self.add(result)
+
+    def merge(self, other: 'EnsembleAggregate'):
+        self.hydrographs += other.hydrographs
+        for name, stat in other.stats.items():
+            self._stat(name, stat.is_datetime).merge(stat)
+
+    def summary(self, percents: List[float] = DEFAULT_AGGREGATE_PERCENTS) -> dict:
+        return {
+            'hydrographs': self.hydrographs,
+            'stats': {name: stat.summary(percents) for name, stat in self.stats.items()},
+        }
+
+    def to_dict(self, percents: List[float] = DEFAULT_AGGREGATE_PERCENTS) -> dict:
+        # the summary, plus the state needed to merge it with other shards
+        d = self.summary(percents)
+        d['state'] = {
+            'compression': self.compression,
+            'hydrographs': self.hydrographs,
+            'stats': {name: stat.to_dict() for name, stat in self.stats.items()},
+        }
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'EnsembleAggregate':
+        state = d['state']
+        aggregate = cls(state['compression'])
+        aggregate.hydrographs = state['hydrographs']
+        aggregate.stats = {name: StatSummary.from_dict(stat)
+                           for name, stat in state['stats'].items()}
+        return aggregate
 
 
 def get_usgs_tz(tz_cd: str):
     return tz.gettz(USGS_TZ_MAPPINGS.get(tz_cd))
 
 
-def localize_usgs_datetime(row: pd.Series) -> pd.Series:
-    tzinfo = USGS_TZ_MAPPINGS.get(row[USGS_COL_TZ])
-    return row[USGS_COL_DATETIME].tz_localize(tzinfo)
+def localize_usgs_datetimes(datetimes: pd.Series, tz_cd: pd.Series) -> pd.Series:
+    # tz_cd gives each row's UTC offset, which also settles the repeated hour
+    # when daylight saving time ends
+    offsets = tz_cd.map(USGS_TZ_OFFSETS).astype(float)
+    if offsets.isna().all():
+        return datetimes
+    if offsets.isna().any():
+        unknown = sorted(set(tz_cd[offsets.isna()].astype(str)))
+        raise ValueError(f'Unknown USGS time zone codes: {unknown}')
+    utc = datetimes - pd.to_timedelta(offsets, unit='h')
+    return utc.dt.tz_localize('UTC').dt.tz_convert(USGS_TZ_MAPPINGS[tz_cd.iloc[0]])
+
+
+def is_usgs_flow_col(col: str) -> bool:
+    # instantaneous values are <ts id>_00060, daily values
+    # <ts id>_00060_<statistic>; qualification codes end in _cd
+    return USGS_COL_FLOW_ENDSWITH in col.split('_')[1:] and not col.endswith('_cd')
 
 
 def get_usgs_flow_col(df: pd.DataFrame) -> str:
-    col_idx_flow = list(df.columns.str.endswith(
-        USGS_COL_FLOW_ENDSWITH)).index(True)
-    col_flow = df.columns[col_idx_flow]
-    return col_flow
-
-
-def read_usgs_rdb(hydrograph: Union[str, PathLike, StringIO]) -> pd.DataFrame:
-    # def read_usgs_rdb(hydrograph: Union[str, PathLike, StringIO], storage_options: dict) -> pd.DataFrame:
-    df = pd.read_table(hydrograph, sep=USGS_SEP, comment='#', header=[0, 1])
-    df.columns = df.columns.droplevel(1)
-    df[USGS_COL_DATETIME] = pd.to_datetime(
-        df[USGS_COL_DATETIME], infer_datetime_format=True)
-    df[USGS_COL_DATETIME] = df.apply(localize_usgs_datetime, axis=1)
+    return get_usgs_flow_cols(df)[0]
+
+
+def get_usgs_flow_cols(df: pd.DataFrame) -> List[str]:
+    return [col for col in df.columns if is_usgs_flow_col(col)]
+
+
+def read_usgs_rdb(hydrograph: Union[str, PathLike, StringIO], all_series: bool = False) -> pd.DataFrame:
+    if not hasattr(hydrograph, 'readline'):
+        with open(hydrograph) as f:
+            return read_usgs_rdb(f, all_series)
+    # RDB: '#' comment lines, a header row, then a row of column widths and
+    # types (e.g. 20d, 14n, 5s)
+    line = hydrograph.readline()
+    while line.startswith('#'):
+        line = hydrograph.readline()
+    columns = line.rstrip('\r\n').split(USGS_SEP)
+    types = dict(zip(columns, hydrograph.readline().rstrip('\r\n').split(USGS_SEP)))
+    col_flows = [col for col in columns
+                 if is_usgs_flow_col(col) and types[col].endswith('n')]
+    if not col_flows:
+        raise ValueError(
+            f'No discharge ({USGS_COL_FLOW_ENDSWITH}) column found.')
+    if not all_series:
+        col_flows = col_flows[:1]
+    # daily values have no tz_cd
+    col_tz = [USGS_COL_TZ] if USGS_COL_TZ in columns else []
+    # only the columns used are parsed; flows with qualification codes (e.g.
+    # Ice) are left as strings for screening
+    df = pd.read_csv(hydrograph, sep=USGS_SEP, header=None, names=columns,
+                     usecols=[USGS_COL_DATETIME] + col_tz + col_flows,
+                     dtype={USGS_COL_DATETIME: str, USGS_COL_TZ: 'category'})
+    df = df[[USGS_COL_DATETIME] + col_tz + col_flows]
+    try:
+        datetimes = pd.to_datetime(
+            df[USGS_COL_DATETIME], format=USGS_DATETIME_FORMAT)
+    except ValueError:
+        # daily values are dates, and stay naive without tz_cd
+        datetimes = pd.to_datetime(
+            df[USGS_COL_DATETIME], format=USGS_DATE_FORMAT)
+    if col_tz:
+        datetimes = localize_usgs_datetimes(datetimes, df[USGS_COL_TZ])
+    df[USGS_COL_DATETIME] = datetimes
     return df
 
 
@@ -157,6 +844,35 @@ class HydrographStatsConfig:
     pretty_print: bool = DEFAULT_PRETTY_PRINT
     out: Optional[str] = DEFAULT_OUT
     out_fsspec_kwargs: Optional[dict] = DEFAULT_OUT_FSSPEC_KWARGS
+    listing_cache: Optional[str] = DEFAULT_LISTING_CACHE
+    listing_cache_ttl: Optional[float] = DEFAULT_LISTING_CACHE_TTL
+    listing_workers: int = DEFAULT_LISTING_WORKERS
+    checkpoint: Optional[str] = DEFAULT_CHECKPOINT
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY
+    resume: bool = DEFAULT_RESUME
+    stats: List[str] = field(default_factory=list)
+    exceedance_percents: List[float] = field(
+        default_factory=lambda: list(DEFAULT_EXCEEDANCE_PERCENTS))
+    threshold: Optional[float] = DEFAULT_THRESHOLD
+    pot_threshold: Optional[float] = DEFAULT_POT_THRESHOLD
+    pot_min_separation: str = DEFAULT_POT_MIN_SEPARATION
+    pot_min_drop_ratio: Optional[float] = DEFAULT_POT_MIN_DROP_RATIO
+    group_by: Optional[str] = DEFAULT_GROUP_BY
+    seasons: Optional[dict] = DEFAULT_SEASONS
+    jsonl: bool = DEFAULT_JSONL
+    qc: bool = DEFAULT_QC
+    max_gap: Optional[str] = DEFAULT_MAX_GAP
+    parsed_cache: Optional[str] = DEFAULT_PARSED_CACHE
+    max_workers: int = DEFAULT_MAX_WORKERS
+    memory_budget: Optional[int] = DEFAULT_MEMORY_BUDGET
+    memory_factor: float = DEFAULT_MEMORY_FACTOR
+    aggregate_out: Optional[str] = DEFAULT_AGGREGATE_OUT
+    aggregate_inputs: List[str] = field(default_factory=list)
+    aggregate_percents: List[float] = field(
+        default_factory=lambda: list(DEFAULT_AGGREGATE_PERCENTS))
+    parse_workers: int = DEFAULT_PARSE_WORKERS
+    parse_chunk_size: int = DEFAULT_PARSE_CHUNK_SIZE
+    usgs_all_series: bool = DEFAULT_USGS_ALL_SERIES
 
     @classmethod
     def from_dict(cls, d: dict) -> 'HydrographStatsConfig':
@@ -175,6 +891,43 @@ class HydrographStatsConfig:
         config.out = d.get('out', DEFAULT_OUT)
         config.out_fsspec_kwargs = d.get(
             'out_fsspec_kwargs', DEFAULT_OUT_FSSPEC_KWARGS)
+        config.listing_cache = d.get('listing_cache', DEFAULT_LISTING_CACHE)
+        config.listing_cache_ttl = d.get(
+            'listing_cache_ttl', DEFAULT_LISTING_CACHE_TTL)
+        config.listing_workers = d.get(
+            'listing_workers', DEFAULT_LISTING_WORKERS)
+        config.checkpoint = d.get('checkpoint', DEFAULT_CHECKPOINT)
+        config.checkpoint_every = d.get(
+            'checkpoint_every', DEFAULT_CHECKPOINT_EVERY)
+        config.resume = d.get('resume', DEFAULT_RESUME)
+        config.stats = d.get('stats', DEFAULT_STATS)
+        config.exceedance_percents = d.get(
+            'exceedance_percents', DEFAULT_EXCEEDANCE_PERCENTS)
+        config.threshold = d.get('threshold', DEFAULT_THRESHOLD)
+        config.pot_threshold = d.get('pot_threshold', DEFAULT_POT_THRESHOLD)
+        config.pot_min_separation = d.get(
+            'pot_min_separation', DEFAULT_POT_MIN_SEPARATION)
+        config.pot_min_drop_ratio = d.get(
+            'pot_min_drop_ratio', DEFAULT_POT_MIN_DROP_RATIO)
+        config.group_by = d.get('group_by', DEFAULT_GROUP_BY)
+        config.seasons = d.get('seasons', DEFAULT_SEASONS)
+        config.jsonl = d.get('jsonl', DEFAULT_JSONL)
+        config.qc = d.get('qc', DEFAULT_QC)
+        config.max_gap = d.get('max_gap', DEFAULT_MAX_GAP)
+        config.parsed_cache = d.get('parsed_cache', DEFAULT_PARSED_CACHE)
+        config.max_workers = d.get('max_workers', DEFAULT_MAX_WORKERS)
+        config.memory_budget = d.get('memory_budget', DEFAULT_MEMORY_BUDGET)
+        config.memory_factor = d.get('memory_factor', DEFAULT_MEMORY_FACTOR)
+        config.aggregate_out = d.get('aggregate_out', DEFAULT_AGGREGATE_OUT)
+        config.aggregate_inputs = d.get(
+            'aggregate_inputs', DEFAULT_AGGREGATE_INPUTS)
+        config.aggregate_percents = d.get(
+            'aggregate_percents', DEFAULT_AGGREGATE_PERCENTS)
+        config.parse_workers = d.get('parse_workers', DEFAULT_PARSE_WORKERS)
+        config.parse_chunk_size = d.get(
+            'parse_chunk_size', DEFAULT_PARSE_CHUNK_SIZE)
+        config.usgs_all_series = d.get(
+            'usgs_all_series', DEFAULT_USGS_ALL_SERIES)
         return config
 
     @classmethod
@@ -188,6 +941,45 @@ class HydrographStatsConfig:
         return cls.from_dict(config_dict)
 
 
+@dataclass
+class HydrographStats:
+    # None when QC screens out every row
+    max: Optional[float]
+    max_datetime: Optional[str]
+    min: Optional[float]
+    min_datetime: Optional[str]
+    avg: Optional[float]
+    duration: str
+    # None where max_gap leaves out every duration window
+    duration_max: Optional[float]
+    duration_max_datetime: Optional[str]
+    duration_min: Optional[float]
+    duration_min_datetime: Optional[str]
+    hydrograph: Optional[str] = None
+    series: Optional[str] = None
+    block: Optional[str] = None
+    events: Optional[List[dict]] = None
+    qc: Optional[dict] = None
+    # the --stats results, e.g. volume or q10
+    extra: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'HydrographStats':
+        d = dict(d)
+        fields = {name: d.pop(name) for name in HYDROGRAPH_STATS_FIELDS}
+        optional = {name: d.pop(name) for name in (
+            'hydrograph', 'series', 'block', 'events', 'qc') if name in d}
+        return cls(**fields, **optional, extra=d)
+
+    def to_dict(self) -> dict:
+        d = {name: getattr(self, name) for name in HYDROGRAPH_STATS_FIELDS}
+        d.update(self.extra)
+        for name in ('events', 'block', 'qc', 'hydrograph', 'series'):
+            if getattr(self, name) is not None:
+                d[name] = getattr(self, name)
+        return d
+
+
 @dataclass
 class WatResourceInfo:
     scheme: str
@@ -287,11 +1079,14 @@ def get_text(uri: str, fsspec_kwargs: dict = {}) -> Union[str, bytes]:
             # read the bytes if this is a dss file
             mode = 'rb'
         with fsspec.open(uri, mode, **fsspec_kwargs) as f:
-            print(uri)
+            # logged on stderr so stdout stays valid JSON (Lines)
+            print(uri, file=sys.stderr)
             return f.read()
 
 
 def write_output(uri: str, output: str, fsspec_kwargs: dict = {}):
+    # None cannot be unpacked with **
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
     uri_parsed = urlparse(uri)
     scheme = uri_parsed.scheme
     if scheme == 'redis' or scheme == 'rediss':
@@ -304,6 +1099,212 @@ def write_output(uri: str, output: str, fsspec_kwargs: dict = {}):
             o.write('\n')
 
 
+def load_checkpoint(uri: str, fsspec_kwargs: Optional[dict] = None) -> List[dict]:
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    uri_parsed = urlparse(uri)
+    scheme = uri_parsed.scheme
+    if scheme == 'redis' or scheme == 'rediss':
+        r = Redis.from_url(uri, decode_responses=True)
+        key = uri_parsed.fragment
+        return [json.loads(entry) for entry in r.lrange(key, 0, -1)]
+    fs, path = fsspec.core.url_to_fs(uri, **fsspec_kwargs)
+    entries = []
+    for part in sorted(fs.glob(path.rstrip('/') + '/part-*.json')):
+        with fs.open(part, 'r') as f:
+            entries.extend(json.load(f))
+    return entries
+
+
+def append_checkpoint(uri: str, entries: List[dict], fsspec_kwargs: Optional[dict] = None):
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    uri_parsed = urlparse(uri)
+    scheme = uri_parsed.scheme
+    if scheme == 'redis' or scheme == 'rediss':
+        r = Redis.from_url(uri, decode_responses=True)
+        key = uri_parsed.fragment
+        r.rpush(key, *[json.dumps(entry) for entry in entries])
+    else:
+        # object stores can't append, so each checkpoint is a new part file
+        part_uri = uri.rstrip('/') + f'/part-{time.time_ns()}.json'
+        with fsspec.open(part_uri, 'w', **fsspec_kwargs) as f:
+            json.dump(entries, f)
+
+
+def clear_checkpoint(uri: str, fsspec_kwargs: Optional[dict] = None):
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    uri_parsed = urlparse(uri)
+    scheme = uri_parsed.scheme
+    if scheme == 'redis' or scheme == 'rediss':
+        r = Redis.from_url(uri, decode_responses=True)
+        key = uri_parsed.fragment
+        r.delete(key)
+    else:
+        fs, path = fsspec.core.url_to_fs(uri, **fsspec_kwargs)
+        parts = fs.glob(path.rstrip('/') + '/part-*.json')
+        if parts:
+            fs.rm(parts)
+
+
+def has_glob_magic(path: str) -> bool:
+    return any(c in path for c in GLOB_MAGIC_CHARS)
+
+
+def is_expandable_uri(uri: str) -> bool:
+    scheme = urlparse(uri).scheme
+    if scheme in ('redis', 'rediss', 'http', 'https'):
+        return False
+    return has_glob_magic(uri) or uri.endswith('/')
+
+
+def list_uris(uri: str, storage_options: Optional[dict] = None, max_workers: int = DEFAULT_LISTING_WORKERS) -> List[str]:
+    # None cannot be unpacked with **
+    storage_options = dict() if storage_options is None else storage_options
+    fs, path = fsspec.core.url_to_fs(uri, **storage_options)
+    parts = path.rstrip('/').split('/')
+    magic_idx = next((i for i, part in enumerate(parts)
+                      if has_glob_magic(part)), None)
+    if magic_idx is not None and '**' in parts[magic_idx]:
+        # recursive patterns can't be fanned out by directory
+        paths = fs.glob(path)
+    else:
+        # List the first level below the fixed part of the pattern once (the
+        # filesystem paginates this call), then fan out over the matching
+        # subdirectories in parallel.
+        if magic_idx is None:
+            root, first, rest = '/'.join(parts), '*', ''
+        else:
+            root = '/'.join(parts[:magic_idx]) or '/'
+            first = parts[magic_idx]
+            rest = '/'.join(parts[magic_idx + 1:])
+        entries = [e for e in fs.ls(root, detail=True)
+                   if fnmatch(e['name'].rstrip('/').rsplit('/', 1)[-1], first)]
+        paths = [e['name'] for e in entries if e['type'] == 'file' and not rest]
+        dirs = [e['name'].rstrip('/')
+                for e in entries if e['type'] == 'directory']
+        if magic_idx is None:
+            lister, dir_patterns = fs.find, dirs
+        else:
+            lister, dir_patterns = fs.glob, [
+                f'{d}/{rest}' for d in dirs] if rest else []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for dir_paths in executor.map(lister, dir_patterns):
+                paths.extend(dir_paths)
+    scheme = urlparse(uri).scheme
+    if scheme:
+        return sorted(f'{scheme}://{p}' for p in paths)
+    if not os.path.isabs(uri):
+        return sorted(os.path.relpath(p) for p in paths)
+    return sorted(paths)
+
+
+def load_listing_cache(uri: str, fsspec_kwargs: Optional[dict] = None) -> dict:
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    fs, path = fsspec.core.url_to_fs(uri, **fsspec_kwargs)
+    if not fs.exists(path):
+        return {}
+    with fs.open(path, 'r') as f:
+        return json.load(f)
+
+
+def expand_hydrograph_uris(hydrographs: List[str], config: HydrographStatsConfig) -> List[str]:
+    listing_cache = load_listing_cache(
+        config.listing_cache, config.storage_options) if config.listing_cache else {}
+    cache_updated = False
+    expanded = []
+    for hydrograph_uri in hydrographs:
+        if config.dss:
+            hydrograph_uri, dss_pathname = hydrograph_uri.rsplit(':', 1)
+            suffix = ':' + dss_pathname
+        else:
+            suffix = ''
+        if not is_expandable_uri(hydrograph_uri):
+            expanded.append(hydrograph_uri + suffix)
+            continue
+        cached = listing_cache.get(hydrograph_uri)
+        if cached is None or (config.listing_cache_ttl is not None
+                              and time.time() - cached['listed_at'] > config.listing_cache_ttl):
+            cached = {
+                'listed_at': time.time(),
+                'uris': list_uris(hydrograph_uri, config.storage_options, config.listing_workers),
+            }
+            listing_cache[hydrograph_uri] = cached
+            cache_updated = True
+        expanded.extend(uri + suffix for uri in cached['uris'])
+    if config.listing_cache and cache_updated:
+        write_output(config.listing_cache, json.dumps(
+            listing_cache), config.storage_options)
+    return expanded
+
+
+def write_aggregate(aggregate: EnsembleAggregate, config: HydrographStatsConfig):
+    uris = []
+    for uri in config.aggregate_inputs:
+        if is_expandable_uri(uri):
+            uris.extend(list_uris(uri, config.out_fsspec_kwargs))
+        else:
+            uris.append(uri)
+    for uri in uris:
+        aggregate.merge(EnsembleAggregate.from_dict(
+            json.loads(get_text(uri, config.out_fsspec_kwargs))))
+    write_output(config.aggregate_out, json.dumps(aggregate.to_dict(config.aggregate_percents)),
+                 config.out_fsspec_kwargs)
+
+
+def get_memory_limit() -> int:
+    physical = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    for path in CGROUP_MEMORY_LIMIT_PATHS:
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        # unlimited is "max" on v2 and a huge number on v1
+        if limit.isdigit() and int(limit) < physical:
+            return int(limit)
+    return physical
+
+
+def get_source_size(uri: str, fsspec_kwargs: Optional[dict] = None) -> Optional[int]:
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    uri_parsed = urlparse(uri)
+    scheme = uri_parsed.scheme
+    if scheme == 'redis' or scheme == 'rediss':
+        r = Redis.from_url(uri)
+        key = uri_parsed.fragment
+        return r.strlen(key)
+    elif scheme == 'http' or scheme == 'https':
+        content_length = requests.head(
+            uri, allow_redirects=True).headers.get('Content-Length')
+        return int(content_length) if content_length else None
+    fs, path = fsspec.core.url_to_fs(uri, **fsspec_kwargs)
+    return fs.size(path)
+
+
+class MemoryBudget:
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.admitted = 0
+        self.peak_admitted = 0
+        self._next_ticket = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount: int, ticket: int):
+        # Work is admitted in ticket order so large inputs aren't starved by a
+        # stream of small ones. Work larger than the whole budget runs alone.
+        with self._condition:
+            self._condition.wait_for(lambda: ticket == self._next_ticket and (
+                self.admitted == 0 or self.admitted + amount <= self.budget))
+            self._next_ticket += 1
+            self.admitted += amount
+            self.peak_admitted = max(self.peak_admitted, self.admitted)
+            self._condition.notify_all()
+
+    def release(self, amount: int):
+        with self._condition:
+            self.admitted -= amount
+            self._condition.notify_all()
+
+
 def get_redis_client_or_none() -> Redis:
     host = os.environ.get('REDIS_HOST')
     port = os.environ.get('REDIS_PORT', 6379)
@@ -319,6 +1320,52 @@ def get_redis_status_key(wat_payload: WatPayload) -> str:
     return key
 
 
+def get_redis_checkpoint_uri(wat_payload: WatPayload) -> Optional[str]:
+    host = os.environ.get('REDIS_HOST')
+    port = os.environ.get('REDIS_PORT', 6379)
+    db = os.environ.get('REDIS_DB', 0)
+    password = os.environ.get('REDIS_PASWORD')
+    if host:
+        auth = f':{quote(password, safe="")}@' if password else ''
+        key = f'{get_redis_status_key(wat_payload)}_checkpoint'
+        return f'redis://{auth}{host}:{port}/{db}#{key}'
+    return None
+
+
+def get_analysis_fingerprint(config: HydrographStatsConfig) -> str:
+    # options that change results; a checkpoint is only resumed with the same ones
+    options = {
+        'usgs_rdb': config.usgs_rdb,
+        'usgs_all_series': config.usgs_all_series,
+        'dss': config.dss,
+        'irregular': config.irregular,
+        'sep': config.sep,
+        'col_idx_dt': config.col_idx_dt,
+        'col_idx_q': config.col_idx_q,
+        'duration': config.duration,
+        'stats': config.stats,
+        'exceedance_percents': config.exceedance_percents,
+        'threshold': config.threshold,
+        'pot_threshold': config.pot_threshold,
+        'pot_min_separation': config.pot_min_separation,
+        'pot_min_drop_ratio': config.pot_min_drop_ratio,
+        'group_by': config.group_by,
+        'seasons': config.seasons,
+        'qc': config.qc,
+        'max_gap': config.max_gap,
+    }
+    return hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()
+
+
+def get_payload_checkpoint_uri(checkpoint: str, wat_payload: WatPayload) -> str:
+    # payloads sharing a config each get their own checkpoint
+    status_key = get_redis_status_key(wat_payload)
+    uri_parsed = urlparse(checkpoint)
+    if uri_parsed.scheme == 'redis' or uri_parsed.scheme == 'rediss':
+        return f'{checkpoint}_{status_key}'
+    return f'{checkpoint.rstrip("/")}/{status_key}'
+
+
 def set_redis_in_progress(wat_payload: WatPayload):
     r = get_redis_client_or_none()
     if r:
@@ -333,7 +1380,449 @@ def set_redis_done(wat_payload: WatPayload):
         r.set(key, 'done')
 
 
-def analyze(config: HydrographStatsConfig, wat_payload: Optional[WatPayload] = None) -> dict:
+def set_redis_failed(wat_payload: WatPayload):
+    r = get_redis_client_or_none()
+    if r:
+        key = get_redis_status_key(wat_payload)
+        r.set(key, 'failed')
+
+
+def analyze_dataframe(df: pd.DataFrame, col_datetime: str, col_flow: str, config: HydrographStatsConfig) -> List[dict]:
+    if config.qc:
+        df, qc = screen_hydrograph(df, col_datetime, col_flow, config.max_gap)
+        if df.empty:
+            # e.g. a winter record whose flows are all Ice
+            result = dict.fromkeys(HYDROGRAPH_STATS_FIELDS)
+            result.update({'duration': config.duration, 'qc': qc})
+            return [result]
+    if config.group_by:
+        if config.pot_threshold is not None:
+            raise ValueError(
+                'Peaks over threshold can\'t be combined with group_by.')
+        results = analyze_hydrograph_blocks(
+            df, col_datetime, col_flow, config.duration, config.group_by, config.seasons,
+            config.stats, config.exceedance_percents, config.threshold, config.max_gap)
+    else:
+        result = analyze_hydrograph(
+            df, col_datetime, col_flow, config.duration,
+            config.stats, config.exceedance_percents, config.threshold, config.max_gap)
+        if config.pot_threshold is not None:
+            result['events'] = hydrograph_peaks_over_threshold(
+                df, col_datetime, col_flow, config.pot_threshold,
+                config.pot_min_separation, config.pot_min_drop_ratio)
+        results = [result]
+    if config.qc:
+        for result in results:
+            result['qc'] = qc
+    return results
+
+
+def hydrograph_frame(hydrograph: HydrographData, config: HydrographStatsConfig) -> Tuple[pd.DataFrame, str, str]:
+    if isinstance(hydrograph, pd.DataFrame):
+        # columns are picked by position, as for CSV hydrographs
+        df = hydrograph
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            # stats look rows up by position
+            df = df.reset_index(drop=True)
+        col_datetime = df.columns[config.col_idx_dt]
+        col_flow = df.columns[config.col_idx_q]
+    elif isinstance(hydrograph, pd.Series):
+        col_datetime = DATA_COL_DATETIME
+        col_flow = DATA_COL_FLOW
+        df = pd.DataFrame({col_datetime: hydrograph.index,
+                           col_flow: hydrograph.to_numpy()})
+    else:
+        datetimes, flows = hydrograph
+        col_datetime = DATA_COL_DATETIME
+        col_flow = DATA_COL_FLOW
+        df = pd.DataFrame({col_datetime: datetimes, col_flow: flows})
+    if not pd.api.types.is_datetime64_any_dtype(df[col_datetime]):
+        df = df.assign(**{col_datetime: pd.to_datetime(df[col_datetime])})
+    return df, col_datetime, col_flow
+
+
+def analyze_data(hydrograph: HydrographData, config: Optional[HydrographStatsConfig] = None,
+                 name: Optional[str] = None) -> List[HydrographStats]:
+    """Analyze a hydrograph already in memory.
+
+    The hydrograph is a DataFrame (columns picked by config.col_idx_dt and
+    config.col_idx_q), a Series of flows indexed by datetime, or a
+    (datetimes, flows) pair of arrays. Returns one result, or one per block
+    when config.group_by is set. Nothing is read, printed or written.
+    """
+    config = HydrographStatsConfig() if config is None else config
+    df, col_datetime, col_flow = hydrograph_frame(hydrograph, config)
+    results = [HydrographStats.from_dict(result)
+               for result in analyze_dataframe(df, col_datetime, col_flow, config)]
+    for result in results:
+        result.hydrograph = name
+    return results
+
+
+def analyze_data_batch(hydrographs: Union[List[HydrographData], Dict[str, HydrographData]],
+                       config: Optional[HydrographStatsConfig] = None) -> List[List[HydrographStats]]:
+    """Analyze many in-memory hydrographs on config.max_workers threads.
+
+    Takes a list of hydrographs, or a dict naming them, in which case each
+    result's hydrograph is set to its name. Results keep the input order.
+    """
+    config = HydrographStatsConfig() if config is None else config
+    if isinstance(hydrographs, dict):
+        names, hydrographs = list(hydrographs.keys()), list(hydrographs.values())
+    else:
+        names = [None] * len(hydrographs)
+    with ThreadPoolExecutor(max_workers=config.max_workers) as executor:
+        return list(executor.map(
+            lambda hydrograph, name: analyze_data(hydrograph, config, name), hydrographs, names))
+
+
+def resolve_hydrograph_uri(hydrograph_uri: str, s3_bucket: Optional[str], dss: bool) -> str:
+    if dss:
+        dss_filepath, dss_pathname = hydrograph_uri.rsplit(':', 1)
+        return resolve_hydrograph_uri(dss_filepath, s3_bucket, False) + ':' + dss_pathname
+    if s3_bucket:
+        return f's3://{s3_bucket}/' + hydrograph_uri.lstrip('/')
+    return hydrograph_uri
+
+
+def parse_hydrograph(raw: Union[str, bytes], hydrograph_uri: str, config: HydrographStatsConfig) -> Tuple[pd.DataFrame, str, str]:
+    if config.usgs_rdb:
+        df = read_usgs_rdb(StringIO(raw), config.usgs_all_series)
+        col_datetime = USGS_COL_DATETIME
+        col_flow = get_usgs_flow_col(df)
+    elif config.dss:
+        dss_filepath, dss_pathname = hydrograph_uri.rsplit(':', 1)
+        # a directory per read so concurrent reads of same-named files don't collide
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_dss_path = os.path.join(
+                temp_dir, os.path.basename(dss_filepath))
+            with open(temp_dss_path, 'wb') as f:
+                f.write(raw)
+            df = read_dss(temp_dss_path + ":" +
+                          dss_pathname, config.irregular)
+        col_datetime = DSS_COL_DATETIME
+        col_flow = DSS_COL_FLOW
+    else:
+        df = pd.read_csv(StringIO(raw), sep=config.sep,
+                         parse_dates=[config.col_idx_dt])
+        col_datetime = df.columns[config.col_idx_dt]
+        col_flow = df.columns[config.col_idx_q]
+        df[col_datetime] = pd.to_datetime(
+            df[col_datetime], infer_datetime_format=True)
+    return df, col_datetime, col_flow
+
+
+def get_source_key(uri: str, fsspec_kwargs: Optional[dict] = None) -> Optional[str]:
+    # The filesystem's key for the object (the ETag on S3, modification time
+    # and size on local disk) identifies its content without downloading it.
+    fsspec_kwargs = dict() if fsspec_kwargs is None else fsspec_kwargs
+    scheme = urlparse(uri).scheme
+    if scheme in ('redis', 'rediss', 'http', 'https'):
+        return None
+    fs, path = fsspec.core.url_to_fs(uri, **fsspec_kwargs)
+    return str(fs.ukey(path))
+
+
+def get_parsed_cache_key(source_key: str, hydrograph_uri: str, config: HydrographStatsConfig) -> str:
+    options = {
+        'version': PARSED_CACHE_VERSION,
+        'usgs_rdb': config.usgs_rdb,
+        'dss': config.dss,
+        'dss_pathname': hydrograph_uri.rsplit(':', 1)[1] if config.dss else None,
+        'irregular': config.irregular,
+        'sep': config.sep,
+        'col_idx_dt': config.col_idx_dt,
+        'col_idx_q': config.col_idx_q,
+    }
+    return hashlib.sha256((source_key + json.dumps(options, sort_keys=True)).encode()).hexdigest()
+
+
+def load_parsed_hydrograph(cache_dir: str, key: str) -> Optional[Tuple[pd.DataFrame, str, str]]:
+    meta_path = os.path.join(cache_dir, f'{key}.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    ns = np.load(os.path.join(cache_dir, f'{key}.datetime.npy'), mmap_mode='r')
+    flow = np.load(os.path.join(cache_dir, f'{key}.flow.npy'), mmap_mode='r')
+    datetimes = pd.Series(ns.view('datetime64[ns]'))
+    tz_info = meta['tz']
+    if isinstance(tz_info, str):
+        datetimes = datetimes.dt.tz_localize('UTC').dt.tz_convert(tz_info)
+    elif tz_info is not None:
+        datetimes = datetimes.dt.tz_localize('UTC').dt.tz_convert(
+            timezone(timedelta(minutes=tz_info)))
+    col_datetime, col_flow = meta['col_datetime'], meta['col_flow']
+    df = pd.DataFrame({col_datetime: datetimes, col_flow: pd.Series(flow)})
+    return df, col_datetime, col_flow
+
+
+def store_parsed_hydrograph(cache_dir: str, key: str, df: pd.DataFrame, col_datetime: str, col_flow: str):
+    datetimes = df[col_datetime]
+    if not (pd.api.types.is_datetime64_any_dtype(datetimes)
+            and pd.api.types.is_numeric_dtype(df[col_flow])):
+        # e.g. flow columns holding qualification codes; parsed every time
+        return
+    tzinfo = datetimes.dt.tz
+    if tzinfo is None:
+        tz_info = None
+    else:
+        # named zones (pytz, zoneinfo) by name, fixed offsets in minutes
+        tz_info = getattr(tzinfo, 'zone', None) or getattr(tzinfo, 'key', None) or \
+            int(tzinfo.utcoffset(None).total_seconds() // 60)
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {
+        'datetime': datetimes.values.astype('datetime64[ns]').view(np.int64),
+        'flow': df[col_flow].to_numpy(dtype=np.float64),
+    }
+    # Temp files are unique per writer, so concurrent runs or threads storing
+    # the same entry each replace whole files.
+    for name, array in arrays.items():
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_path, os.path.join(cache_dir, f'{key}.{name}.npy'))
+    # the metadata file is written last and marks the entry complete
+    meta = {'col_datetime': col_datetime, 'col_flow': col_flow, 'tz': tz_info}
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temp_path, os.path.join(cache_dir, f'{key}.json'))
+
+
+def read_hydrograph(hydrograph_uri: str, config: HydrographStatsConfig) -> Tuple[pd.DataFrame, str, str]:
+    # DSS URIs are <filepath>:<pathname>; only the file is fetched
+    source_uri = hydrograph_uri.rsplit(
+        ':', 1)[0] if config.dss else hydrograph_uri
+    # the cache holds a single flow series
+    if not config.parsed_cache or (config.usgs_rdb and config.usgs_all_series):
+        raw = get_text(source_uri, config.storage_options)
+        return parse_hydrograph(raw, hydrograph_uri, config)
+    raw = None
+    source_key = get_source_key(source_uri, config.storage_options)
+    if source_key is None:
+        raw = get_text(source_uri, config.storage_options)
+        source_key = hashlib.sha256(
+            raw if isinstance(raw, bytes) else raw.encode()).hexdigest()
+    key = get_parsed_cache_key(source_key, hydrograph_uri, config)
+    parsed = load_parsed_hydrograph(config.parsed_cache, key)
+    if parsed is None:
+        if raw is None:
+            raw = get_text(source_uri, config.storage_options)
+        parsed = parse_hydrograph(raw, hydrograph_uri, config)
+        store_parsed_hydrograph(config.parsed_cache, key, *parsed)
+    return parsed
+
+
+def can_parse_in_chunks(hydrograph_uri: str, config: HydrographStatsConfig) -> bool:
+    # Only the base stats have an exact chunked reduction.
+    if config.parse_workers <= 1 or config.usgs_rdb or config.dss:
+        return False
+    if config.qc or config.group_by or config.stats or config.pot_threshold is not None \
+            or config.max_gap is not None or config.parsed_cache:
+        return False
+    if urlparse(hydrograph_uri).scheme in ('redis', 'rediss', 'http', 'https'):
+        return False
+    size = get_source_size(hydrograph_uri, config.storage_options)
+    return size is not None and size > config.parse_chunk_size
+
+
+def csv_chunk_offsets(hydrograph_uri: str, config: HydrographStatsConfig) -> Tuple[bytes, List[int]]:
+    fs, path = fsspec.core.url_to_fs(
+        hydrograph_uri, **(config.storage_options or {}))
+    size = fs.size(path)
+    with fs.open(path, 'rb') as f:
+        header = f.readline()
+        offsets = [len(header)]
+        for offset in range(len(header) + config.parse_chunk_size, size, config.parse_chunk_size):
+            # move each boundary to the start of the next line; starting one
+            # byte early keeps a boundary that already is one
+            f.seek(max(offset - 1, offsets[-1]))
+            f.readline()
+            if offsets[-1] < f.tell() < size:
+                offsets.append(f.tell())
+    offsets.append(size)
+    return header, offsets
+
+
+def reduce_csv_chunk(hydrograph_uri: str, config: HydrographStatsConfig, header: bytes,
+                     start: int, end: int) -> Optional[dict]:
+    fs, path = fsspec.core.url_to_fs(
+        hydrograph_uri, **(config.storage_options or {}))
+    with fs.open(path, 'rb') as f:
+        f.seek(start)
+        raw = (header + f.read(end - start)).decode()
+    df, col_datetime, col_flow = parse_hydrograph(raw, hydrograph_uri, config)
+    if df.empty:
+        return None
+    df = df[[col_datetime, col_flow]]
+    datetimes = df[col_datetime]
+    window = pd.Timedelta(config.duration)
+    # Windows of the head rows reach back into earlier chunks, so they are
+    # computed when merging, from the tails of those chunks.
+    head_end = int(datetimes.searchsorted(
+        datetimes.iloc[0] + window, side='left'))
+    tail_start = int(datetimes.searchsorted(
+        datetimes.iloc[-1] - window, side='right'))
+    df_rolling = hydrograph_rolling_mean(
+        df, col_datetime, col_flow, config.duration).iloc[head_end:]
+    return {
+        'max': hydrograph_max(df, col_datetime, col_flow),
+        'min': hydrograph_min(df, col_datetime, col_flow),
+        'sum': float(df[col_flow].sum()),
+        'count': int(df[col_flow].count()),
+        'duration_max': rolling_extreme(df_rolling, col_datetime, col_flow, hydrograph_max),
+        'duration_min': rolling_extreme(df_rolling, col_datetime, col_flow, hydrograph_min),
+        'head': df.iloc[:head_end],
+        'tail': df.iloc[tail_start:],
+        'col_datetime': col_datetime,
+        'col_flow': col_flow,
+    }
+
+
+def rolling_extreme(df_rolling: pd.DataFrame, col_datetime: str, col_flow: str,
+                    extreme) -> Optional[Tuple[float, pd.Timestamp]]:
+    if not df_rolling[col_flow].notna().any():
+        return None
+    return extreme(df_rolling.reset_index(drop=True), col_datetime, col_flow)
+
+
+def analyze_csv_in_chunks(hydrograph_uri: str, config: HydrographStatsConfig) -> dict:
+    header, offsets = csv_chunk_offsets(hydrograph_uri, config)
+    window = pd.Timedelta(config.duration)
+    # Candidates are kept in file order and only replaced by strictly larger
+    # (smaller) values, so ties resolve to the first row like idxmax does.
+    extremes = {'max': None, 'min': None,
+                'duration_max': None, 'duration_min': None}
+
+    def update(name: str, candidate: Optional[Tuple[float, pd.Timestamp]]):
+        if candidate is None or np.isnan(candidate[0]):
+            return
+        current = extremes[name]
+        if current is None or (candidate[0] > current[0] if name.endswith('max') else candidate[0] < current[0]):
+            extremes[name] = candidate
+
+    total = 0.0
+    count = 0
+    carry = None
+    # spawn rather than fork, since analyze runs this from a thread pool
+    with ProcessPoolExecutor(max_workers=config.parse_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        chunks = executor.map(reduce_csv_chunk, *zip(*[
+            (hydrograph_uri, config, header, start, end) for start, end in zip(offsets[:-1], offsets[1:])]))
+        for chunk in chunks:
+            if chunk is None:
+                continue
+            col_datetime, col_flow = chunk['col_datetime'], chunk['col_flow']
+            head = chunk['head']
+            if len(head):
+                df_window = head if carry is None else pd.concat(
+                    [carry, head], ignore_index=True)
+                df_rolling = hydrograph_rolling_mean(
+                    df_window, col_datetime, col_flow, config.duration).iloc[len(df_window) - len(head):]
+                update('duration_max', rolling_extreme(
+                    df_rolling, col_datetime, col_flow, hydrograph_max))
+                update('duration_min', rolling_extreme(
+                    df_rolling, col_datetime, col_flow, hydrograph_min))
+            for name in extremes:
+                update(name, chunk[name])
+            total += chunk['sum']
+            count += chunk['count']
+            # rows within one window of the latest row, for the next chunk's head
+            carry = chunk['tail'] if carry is None else pd.concat(
+                [carry, chunk['tail']], ignore_index=True)
+            carry = carry[carry[col_datetime] >
+                          carry[col_datetime].iloc[-1] - window]
+    return {
+        'max': extremes['max'][0],
+        'max_datetime': extremes['max'][1].isoformat(),
+        'min': extremes['min'][0],
+        'min_datetime': extremes['min'][1].isoformat(),
+        'avg': total / count,
+        'duration': config.duration,
+        'duration_max': extremes['duration_max'][0],
+        'duration_max_datetime': extremes['duration_max'][1].isoformat(),
+        'duration_min': extremes['duration_min'][0],
+        'duration_min_datetime': extremes['duration_min'][1].isoformat(),
+    }
+
+
+def estimate_parse_memory(hydrograph_uris: List[str], config: HydrographStatsConfig,
+                          memory_budget: int) -> Dict[str, int]:
+    source_uris = [uri.rsplit(':', 1)[0] if config.dss else uri
+                   for uri in hydrograph_uris]
+    with ThreadPoolExecutor(max_workers=config.listing_workers) as executor:
+        sizes = list(executor.map(
+            lambda uri: get_source_size(uri, config.storage_options), source_uris))
+    # unknown sizes get an even share of the budget
+    unknown = memory_budget // config.max_workers
+    return {uri: int(size * config.memory_factor) if size is not None else unknown
+            for uri, size in zip(hydrograph_uris, sizes)}
+
+
+def analyze_hydrograph_uri(hydrograph_uri: str, config: HydrographStatsConfig,
+                           budget: Optional[MemoryBudget] = None, ticket: int = 0,
+                           estimate: int = 0) -> List[dict]:
+    if budget:
+        budget.acquire(estimate, ticket)
+    try:
+        if can_parse_in_chunks(hydrograph_uri, config):
+            hydrograph_results = [analyze_csv_in_chunks(hydrograph_uri, config)]
+        else:
+            df, col_datetime, col_flow = read_hydrograph(
+                hydrograph_uri, config)
+            if config.usgs_rdb and config.usgs_all_series:
+                hydrograph_results = []
+                for col_flow in get_usgs_flow_cols(df):
+                    series_results = analyze_dataframe(
+                        df[[col_datetime, col_flow]], col_datetime, col_flow, config)
+                    for result in series_results:
+                        result['series'] = col_flow
+                    hydrograph_results.extend(series_results)
+            else:
+                hydrograph_results = analyze_dataframe(
+                    df, col_datetime, col_flow, config)
+    finally:
+        if budget:
+            budget.release(estimate)
+    for result in hydrograph_results:
+        # DSS results are reported against the file, without the record pathname
+        result['hydrograph'] = hydrograph_uri.rsplit(
+            ':', 1)[0] if config.dss else hydrograph_uri
+    return hydrograph_results
+
+
+def analyze_hydrograph_uris(hydrograph_uris: List[str], config: HydrographStatsConfig,
+                            budget: Optional[MemoryBudget] = None,
+                            estimates: Optional[Dict[str, int]] = None) -> Iterator[List[dict]]:
+    # Yields results in input order. Only a window of hydrographs is submitted
+    # ahead, and pending ones are cancelled on error, so a failing input stops
+    # the run without analyzing the rest.
+    if config.max_workers <= 1:
+        for hydrograph_uri in hydrograph_uris:
+            yield analyze_hydrograph_uri(hydrograph_uri, config)
+        return
+    estimates = dict() if estimates is None else estimates
+    executor = ThreadPoolExecutor(max_workers=config.max_workers)
+    futures = deque()
+    try:
+        for ticket, hydrograph_uri in enumerate(hydrograph_uris):
+            futures.append(executor.submit(analyze_hydrograph_uri, hydrograph_uri, config, budget,
+                                           ticket, estimates.get(hydrograph_uri, 0)))
+            if len(futures) >= SUBMIT_WINDOW_FACTOR * config.max_workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        # Cancelled work is always a suffix of the tickets, so running work
+        # never waits on it for admission.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def analyze(config: HydrographStatsConfig, wat_payload: Optional[WatPayload] = None,
+            result_cache: Optional[dict] = None, aggregate: Optional[EnsembleAggregate] = None) -> dict:
     s3_bucket = os.environ.get('S3_BUCKET')
     if wat_payload:
         set_redis_in_progress(wat_payload)
@@ -343,52 +1832,84 @@ def analyze(config: HydrographStatsConfig, wat_payload: Optional[WatPayload] = N
     else:
         hydrographs = config.hydrographs
         out = config.out
+    hydrographs = [resolve_hydrograph_uri(h, s3_bucket, config.dss)
+                   for h in hydrographs]
+    hydrographs = expand_hydrograph_uris(hydrographs, config)
+    checkpoint = config.checkpoint
+    if checkpoint and wat_payload:
+        checkpoint = get_payload_checkpoint_uri(checkpoint, wat_payload)
+    elif wat_payload:
+        checkpoint = get_redis_checkpoint_uri(wat_payload)
+    fingerprint = get_analysis_fingerprint(config)
+    completed = {}
+    if checkpoint and config.resume:
+        entries = load_checkpoint(checkpoint, config.out_fsspec_kwargs)
+        if any(entry.get('config') != fingerprint for entry in entries):
+            raise ValueError(
+                f'Checkpoint {checkpoint} was written with different analysis options. '
+                'Run without --resume to start over.')
+        completed = {entry['hydrograph']: entry['results']
+                     for entry in entries}
+    elif checkpoint:
+        clear_checkpoint(checkpoint, config.out_fsspec_kwargs)
+    elif config.resume:
+        raise ValueError('Resuming requires a checkpoint location.')
+    # ordered and de-duplicated
+    to_read = dict.fromkeys(uri for uri in hydrographs if uri not in completed and not (
+        result_cache is not None and uri in result_cache))
+    if config.max_workers > 1:
+        budget = MemoryBudget(config.memory_budget or int(
+            MEMORY_BUDGET_FRACTION * get_memory_limit()))
+        estimates = estimate_parse_memory(list(to_read), config, budget.budget)
+    else:
+        budget = None
+        estimates = {}
+    # an aggregate passed in is shared with other payloads and written by the caller
+    owns_aggregate = aggregate is None and config.aggregate_out
+    if owns_aggregate:
+        aggregate = EnsembleAggregate()
     results = []
-    for hydrograph_uri in hydrographs:
-        if config.usgs_rdb:
-            if s3_bucket:
-                hydrograph_uri = f's3://{s3_bucket}/' + \
-                    hydrograph_uri.lstrip('/')
-            hydrograph = StringIO(
-                get_text(hydrograph_uri, config.storage_options))
-            df = read_usgs_rdb(hydrograph)
-            col_datetime = USGS_COL_DATETIME
-            col_flow = get_usgs_flow_col(df)
-        elif config.dss:
-            dss_filepath, dss_pathname = hydrograph_uri.rsplit(':', 1)
-            if s3_bucket:
-                hydrograph_uri = f's3://{s3_bucket}/' + \
-                    dss_filepath.lstrip('/')
+    pending = []
+    analyzed = {}
+    with closing(analyze_hydrograph_uris(list(to_read), config, budget, estimates)) as analyzed_results:
+        for hydrograph_uri in hydrographs:
+            if hydrograph_uri in completed:
+                hydrograph_results = completed[hydrograph_uri]
+                if result_cache is not None:
+                    result_cache[hydrograph_uri] = hydrograph_results
+            elif hydrograph_uri in to_read:
+                # collected in order, so output and checkpoints keep the input order
+                if hydrograph_uri not in analyzed:
+                    analyzed[hydrograph_uri] = next(analyzed_results)
+                hydrograph_results = analyzed[hydrograph_uri]
+                if result_cache is not None:
+                    result_cache[hydrograph_uri] = hydrograph_results
+                if checkpoint:
+                    pending.append({'hydrograph': hydrograph_uri,
+                                    'config': fingerprint,
+                                    'results': hydrograph_results})
             else:
-                hydrograph_uri = dss_filepath
-            hydrograph_dss_bytes = get_text(
-                hydrograph_uri, config.storage_options)
-            temp_dss_path = os.path.join(
-                tempfile.gettempdir(), os.path.basename(dss_filepath))
-            with open(temp_dss_path, 'wb') as f:
-                f.write(hydrograph_dss_bytes)
-            df = read_dss(temp_dss_path + ":" + dss_pathname, config.irregular)
-            col_datetime = DSS_COL_DATETIME
-            col_flow = DSS_COL_FLOW
-        else:
-            if s3_bucket:
-                hydrograph_uri = f's3://{s3_bucket}/' + \
-                    hydrograph_uri.lstrip('/')
-            hydrograph = StringIO(
-                get_text(hydrograph_uri, config.storage_options))
-            df = pd.read_csv(hydrograph, sep=config.sep,
-                             parse_dates=[config.col_idx_dt])
-            col_datetime = df.columns[config.col_idx_dt]
-            col_flow = df.columns[config.col_idx_q]
-            df[col_datetime] = pd.to_datetime(
-                df[col_datetime], infer_datetime_format=True)
-        result = analyze_hydrograph(
-            df, col_datetime, col_flow, config.duration)
-        result['hydrograph'] = hydrograph_uri
-        results.append(result)
-    indent = 2 if config.pretty_print else None
-    output = json.dumps(results, indent=indent)
-    print(output)
+                # shared with an earlier payload analyzed with the same config
+                hydrograph_results = [dict(result)
+                                      for result in result_cache[hydrograph_uri]]
+            results.extend(hydrograph_results)
+            if aggregate is not None:
+                aggregate.add_hydrograph(hydrograph_results)
+            if config.jsonl:
+                for result in hydrograph_results:
+                    print(json.dumps(result))
+            if checkpoint and len(pending) >= config.checkpoint_every:
+                append_checkpoint(checkpoint, pending,
+                                  config.out_fsspec_kwargs)
+                pending = []
+    if checkpoint and pending:
+        append_checkpoint(checkpoint, pending, config.out_fsspec_kwargs)
+    if config.jsonl:
+        output = '\n'.join(json.dumps(result) for result in results)
+    else:
+        indent = 2 if config.pretty_print else None
+        output = json.dumps(results, indent=indent)
+        print(output)
     if out:
         if wat_payload and s3_bucket:
             output_name = wat_payload.required_outputs[0].name
@@ -397,8 +1918,21 @@ def analyze(config: HydrographStatsConfig, wat_payload: Optional[WatPayload] = N
         else:
             output_path = out
         write_output(output_path, output, config.out_fsspec_kwargs)
+    if owns_aggregate:
+        write_aggregate(aggregate, config)
+    if budget:
+        # ru_maxrss is in KiB on Linux
+        memory_report = {
+            'memory_budget': budget.budget,
+            'peak_admitted': budget.peak_admitted,
+            'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+        print(json.dumps(memory_report), file=sys.stderr)
     if wat_payload:
         set_redis_done(wat_payload)
+        if checkpoint and not config.checkpoint:
+            # the default checkpoint is only kept to resume an unfinished payload
+            clear_checkpoint(checkpoint, config.out_fsspec_kwargs)
     return results
 
 
@@ -409,7 +1943,9 @@ def parse_args(raw_args: List[str]) -> argparse.Namespace:
     parser.add_argument('--storage-options', default=DEFAULT_STORAGE_OPTIONS, type=json.loads,
                         help=f"Storage options for hydrographs, passed to pandas.read_csv. JSON. Default: {DEFAULT_STORAGE_OPTIONS}")
     parser.add_argument(
-        '--wat-payload', default=DEFAULT_WAT_PAYLOAD, help='WAT payload file (YAML).')
+        '--wat-payload', default=DEFAULT_WAT_PAYLOAD, nargs='+',
+        help=('WAT payload file (YAML). Several payloads, globs or prefixes ending in "/" run as one batch, '
+              'loading each distinct config once and reading hydrographs shared between payloads once.'))
     parser.add_argument('--wat-payload-fsspec-kwargs', default=DEFAULT_WAT_PAYLOAD_FSSPEC_KWARGS, type=json.loads,
                         help=f"Extra options passed to fsspec.open to read WAT payload file. JSON. Default: {DEFAULT_WAT_PAYLOAD_FSSPEC_KWARGS}")
     parser.add_argument('--config', default=DEFAULT_CONFIG,
@@ -427,6 +1963,10 @@ def parse_args(raw_args: List[str]) -> argparse.Namespace:
                         help=f'Flow column index. Default: {DEFAULT_COL_IDX_Q}')
     parser.add_argument('--usgs-rdb', action='store_true', default=DEFAULT_USGS_RDB,
                         help=f'Hydrograph in USGS RDB format. Overrides column and sep options. Default: {DEFAULT_USGS_RDB}')
+    parser.add_argument('--usgs-all-series', action='store_true', default=DEFAULT_USGS_ALL_SERIES,
+                        help=('Analyze every discharge series (00060 columns) of a USGS RDB hydrograph, '
+                              'adding a series key to each result. Otherwise only the first series is analyzed. '
+                              f'Parsed hydrographs aren\'t cached with this option. Default: {DEFAULT_USGS_ALL_SERIES}'))
     parser.add_argument('--dss', action='store_true', default=DEFAULT_DSS,
                         help=f'Hydrograph in HEC-DSS format <filepath>:<pathname>. Specify --irregular if data is irregular. Default: {DEFAULT_DSS}')
     parser.add_argument('--irregular', action='store_true',
@@ -437,31 +1977,171 @@ def parse_args(raw_args: List[str]) -> argparse.Namespace:
                         help=f"Output location. Default: {DEFAULT_OUT}")
     parser.add_argument('--out-fsspec-kwargs', default=DEFAULT_OUT_FSSPEC_KWARGS, type=json.loads,
                         help=f"Extra options passed to fsspec.open for writing results. JSON. Default: {DEFAULT_OUT_FSSPEC_KWARGS}")
+    parser.add_argument('--listing-cache', default=DEFAULT_LISTING_CACHE,
+                        help=f"JSON file caching the expansion of hydrograph globs and prefixes between runs. Default: {DEFAULT_LISTING_CACHE}")
+    parser.add_argument('--listing-cache-ttl', default=DEFAULT_LISTING_CACHE_TTL, type=float,
+                        help=f"Seconds before a cached listing is refreshed. Never expires if not set. Default: {DEFAULT_LISTING_CACHE_TTL}")
+    parser.add_argument('--listing-workers', default=DEFAULT_LISTING_WORKERS, type=int,
+                        help=f"Number of parallel listing requests when expanding hydrograph globs and prefixes. Default: {DEFAULT_LISTING_WORKERS}")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT,
+                        help=("Location for periodic checkpoints of completed results: a Redis key (redis://host/db#key) "
+                              "or a directory for checkpoint part files. Defaults to a Redis key next to the WAT "
+                              f"status key when running a WAT payload with REDIS_HOST set. With WAT payloads, each payload "
+                              f"checkpoints under its own key or subdirectory. Default: {DEFAULT_CHECKPOINT}"))
+    parser.add_argument('--checkpoint-every', default=DEFAULT_CHECKPOINT_EVERY, type=int,
+                        help=f"Number of completed hydrographs between checkpoints. Default: {DEFAULT_CHECKPOINT_EVERY}")
+    parser.add_argument('--resume', action='store_true', default=DEFAULT_RESUME,
+                        help=("Resume from the checkpoint, skipping hydrographs that already completed. Fails if the "
+                              f"checkpoint was written with different analysis options. Default: {DEFAULT_RESUME}"))
+    parser.add_argument('--stats', default=DEFAULT_STATS, nargs='+', choices=EXTRA_STATS,
+                        help=f"Extra stats computed from the same loaded hydrograph. Default: {DEFAULT_STATS}")
+    parser.add_argument('--exceedance-percents', default=DEFAULT_EXCEEDANCE_PERCENTS, nargs='+', type=float,
+                        help=f"Percent of time exceeded for the exceedance stat, e.g. 10 for Q10. Default: {DEFAULT_EXCEEDANCE_PERCENTS}")
+    parser.add_argument('--threshold', default=DEFAULT_THRESHOLD, type=float,
+                        help=f"Flow threshold for the threshold_duration stat. Default: {DEFAULT_THRESHOLD}")
+    parser.add_argument('--pot-threshold', default=DEFAULT_POT_THRESHOLD, type=float,
+                        help=f"If specified, list independent peaks above this flow as events (peaks over threshold). Default: {DEFAULT_POT_THRESHOLD}")
+    parser.add_argument('--pot-min-separation', default=DEFAULT_POT_MIN_SEPARATION,
+                        help=f'Minimum time between independent peaks. Duration string. Default: "{DEFAULT_POT_MIN_SEPARATION}"')
+    parser.add_argument('--pot-min-drop-ratio', default=DEFAULT_POT_MIN_DROP_RATIO, type=float,
+                        help=("If specified, flow must also recede below this fraction of the smaller of two peaks "
+                              f"between them for both to count as independent, e.g. 0.75. Default: {DEFAULT_POT_MIN_DROP_RATIO}"))
+    parser.add_argument('--group-by', default=DEFAULT_GROUP_BY, choices=GROUP_BY_OPTIONS,
+                        help=f"Compute stats per block of the hydrograph, one result per block. Default: {DEFAULT_GROUP_BY}")
+    parser.add_argument('--seasons', default=DEFAULT_SEASONS, type=json.loads,
+                        help=('Seasons for --group-by season, mapping season names to lists of months. JSON. '
+                              f'Default: {METEOROLOGICAL_SEASONS}'))
+    parser.add_argument('--jsonl', action='store_true', default=DEFAULT_JSONL,
+                        help=f'Output JSON Lines, printing results as each hydrograph completes. Default: {DEFAULT_JSONL}')
+    parser.add_argument('--qc', action='store_true', default=DEFAULT_QC,
+                        help=('Screen hydrographs before analysis: drop non-numeric flow codes and missing values, sort, '
+                              f'drop duplicate timestamps, and add a qc summary to each result. Default: {DEFAULT_QC}'))
+    parser.add_argument('--max-gap', default=DEFAULT_MAX_GAP,
+                        help=('If specified, duration windows spanning a gap between timestamps longer than this are '
+                              'excluded from duration_max and duration_min, as are windows reaching back before the first timestamp. '
+                              'Both are null if no window is left. Duration string. '
+                              f'Default: {DEFAULT_MAX_GAP}'))
+    parser.add_argument('--parsed-cache', default=DEFAULT_PARSED_CACHE,
+                        help=('Local directory storing parsed hydrographs as binary arrays, memory-mapped by later runs '
+                              f'instead of re-reading and re-parsing the source. Default: {DEFAULT_PARSED_CACHE}'))
+    parser.add_argument('--max-workers', default=DEFAULT_MAX_WORKERS, type=int,
+                        help=('Number of hydrographs analyzed in parallel, subject to --memory-budget. '
+                              f'Default: {DEFAULT_MAX_WORKERS}'))
+    parser.add_argument('--memory-budget', default=DEFAULT_MEMORY_BUDGET, type=int,
+                        help=('Bytes of estimated parse memory admitted at once when running in parallel. '
+                              f'Default: {int(MEMORY_BUDGET_FRACTION * 100)}%% of the container (cgroup) memory limit'))
+    parser.add_argument('--memory-factor', default=DEFAULT_MEMORY_FACTOR, type=float,
+                        help=f'Estimated parse memory per byte of hydrograph source. Default: {DEFAULT_MEMORY_FACTOR}')
+    parser.add_argument('--aggregate-out', default=DEFAULT_AGGREGATE_OUT,
+                        help=('If specified, summarize each stat across all hydrographs (count, mean, std, min, max, '
+                              'percentiles) and write the summary with its mergeable sketches to this location. '
+                              f'Default: {DEFAULT_AGGREGATE_OUT}'))
+    parser.add_argument('--aggregate-inputs', default=DEFAULT_AGGREGATE_INPUTS, nargs='+',
+                        help=('Summaries written by --aggregate-out in other runs, e.g. other shards of an ensemble, '
+                              f'merged into this run\'s summary. Default: {DEFAULT_AGGREGATE_INPUTS}'))
+    parser.add_argument('--aggregate-percents', default=DEFAULT_AGGREGATE_PERCENTS, nargs='+', type=float,
+                        help=f'Percentiles reported in the summary. Default: {DEFAULT_AGGREGATE_PERCENTS}')
+    parser.add_argument('--parse-workers', default=DEFAULT_PARSE_WORKERS, type=int,
+                        help=('Number of processes parsing chunks of a single CSV hydrograph larger than '
+                              '--parse-chunk-size. Applies to local and range-readable remote CSVs when no QC, '
+                              f'grouping, extra stats, peaks over threshold, max gap or parsed cache is used. Default: {DEFAULT_PARSE_WORKERS}'))
+    parser.add_argument('--parse-chunk-size', default=DEFAULT_PARSE_CHUNK_SIZE, type=int,
+                        help=f'Bytes of CSV parsed per chunk with --parse-workers. Default: {DEFAULT_PARSE_CHUNK_SIZE}')
     args = parser.parse_args(raw_args)
     return args
 
 
+def get_wat_config_path(wat_payload: WatPayload) -> str:
+    s3_bucket = os.environ.get('S3_BUCKET')
+    if s3_bucket:
+        return f's3://{s3_bucket}/' + \
+            wat_payload.model_configuration_paths[0].lstrip('/')
+    return wat_payload.model_configuration_paths[0]
+
+
+def analyze_wat_payloads(wat_payload_uris: List[str], wat_payload_fsspec_kwargs: Optional[dict] = None,
+                         config_fsspec_kwargs: Optional[dict] = None, checkpoint: Optional[str] = None,
+                         resume: bool = False) -> List[dict]:
+    uris = []
+    for uri in wat_payload_uris:
+        if is_expandable_uri(uri):
+            uris.extend(list_uris(uri, wat_payload_fsspec_kwargs))
+        else:
+            uris.append(uri)
+
+    def load_wat_payload(uri: str) -> Union[WatPayload, Exception]:
+        # a missing or malformed payload fails alone, like a failing analysis
+        try:
+            return WatPayload.from_yaml(uri, wat_payload_fsspec_kwargs)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=DEFAULT_LISTING_WORKERS) as executor:
+        wat_payloads = list(executor.map(load_wat_payload, uris))
+    # Events of a realization typically share a config and inputs, so configs
+    # are loaded once and results are reused for inputs seen with the same
+    # config.
+    configs = {}
+    result_caches = {}
+    # one ensemble summary per config, across all of its payloads
+    aggregates = {}
+    results = []
+    # a failing payload is marked failed and the rest of the batch carries on
+    failed = []
+    for uri, wat_payload in zip(uris, wat_payloads):
+        if isinstance(wat_payload, Exception):
+            # without a payload there's no status key to mark failed
+            traceback.print_exception(
+                type(wat_payload), wat_payload, wat_payload.__traceback__)
+            failed.append((uri, wat_payload))
+            continue
+        try:
+            config_path = get_wat_config_path(wat_payload)
+            if config_path not in configs:
+                config = HydrographStatsConfig.from_yaml(
+                    config_path, config_fsspec_kwargs)
+                apply_checkpoint_args(config, checkpoint, resume)
+                configs[config_path] = config
+                result_caches[config_path] = {}
+                if config.aggregate_out:
+                    aggregates[config_path] = EnsembleAggregate()
+            results.extend(analyze(
+                configs[config_path], wat_payload, result_caches[config_path],
+                aggregates.get(config_path)))
+        except Exception as e:
+            traceback.print_exc()
+            set_redis_failed(wat_payload)
+            failed.append((uri, e))
+    for config_path, aggregate in aggregates.items():
+        write_aggregate(aggregate, configs[config_path])
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {len(uris)} WAT payloads failed: ' +
+                           ', '.join(f'{uri} ({e!r})' for uri, e in failed)) from failed[0][1]
+    return results
+
+
+def apply_checkpoint_args(config: HydrographStatsConfig, checkpoint: Optional[str], resume: bool):
+    # a rerun of a preempted job resumes from the command line, whatever the config file says
+    if checkpoint:
+        config.checkpoint = checkpoint
+    if resume:
+        config.resume = True
+
+
 def main(args: List[str]):
     parsed_args = parse_args(args)
     if parsed_args.wat_payload:
-        wat_payload = WatPayload.from_yaml(
-            parsed_args.wat_payload, parsed_args.wat_payload_fsspec_kwargs)
-        s3_bucket = os.environ.get('S3_BUCKET')
-        if s3_bucket:
-            config_path = f's3://{s3_bucket}/' + \
-                wat_payload.model_configuration_paths[0].lstrip('/')
-        else:
-            config_path = wat_payload.model_configuration_paths[0]
-        config = HydrographStatsConfig.from_yaml(config_path,
-                                                 parsed_args.config_fsspec_kwargs)
+        return analyze_wat_payloads(parsed_args.wat_payload, parsed_args.wat_payload_fsspec_kwargs,
+                                    parsed_args.config_fsspec_kwargs, parsed_args.checkpoint,
+                                    parsed_args.resume)
     elif parsed_args.config:
-        wat_payload = None
         config = HydrographStatsConfig.from_yaml(
             parsed_args.config, parsed_args.config_fsspec_kwargs)
+        apply_checkpoint_args(
+            config, parsed_args.checkpoint, parsed_args.resume)
     else:
-        wat_payload = None
         config = HydrographStatsConfig.from_args(parsed_args)
-    return analyze(config, wat_payload)
+    return analyze(config)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,111 @@
+from hydrograph_stats import HydrographStatsConfig, analyze_data, analyze_data_batch, hydrograph_extra_stats, main, \
+    read_usgs_rdb
+from io import StringIO
+from .resources import *
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.mark.integration
+def test_api_matches_script():
+    expected = main([PATH_HSM1_CSV])
+    df = pd.read_csv(PATH_HSM1_CSV, parse_dates=[0])
+    result = analyze_data(df, name=PATH_HSM1_CSV)
+    assert [stats.to_dict() for stats in result] == expected
+
+
+@pytest.mark.integration
+def test_api_batch():
+    df = pd.read_csv(PATH_HSM1_CSV, parse_dates=[0])
+    series = pd.Series(df.iloc[:, 1].to_numpy(), index=df.iloc[:, 0])
+    arrays = (df.iloc[:, 0].to_numpy(), df.iloc[:, 1].to_numpy())
+    config = HydrographStatsConfig(stats=['volume'], max_workers=3)
+    results = analyze_data_batch({'df': df, 'series': series, 'arrays': arrays}, config)
+    assert [result[0].hydrograph for result in results] == ['df', 'series', 'arrays']
+    for result in results:
+        assert result[0].max == pytest.approx(9.447773309400784)
+        assert result[0].extra['volume'] == pytest.approx(results[0][0].extra['volume'])
+
+
+@pytest.mark.integration
+def test_api_season_across_new_year():
+    datetimes = pd.date_range('2021-10-01', '2023-03-31 23:00', freq='H')
+    flows = datetimes.month.to_numpy(dtype=float)
+    # listed in calendar order, but the wet season runs Nov-Mar
+    seasons = {'wet': [1, 2, 3, 11, 12], 'dry': [4, 5, 6, 7, 8, 9, 10]}
+    config = HydrographStatsConfig(group_by='season', seasons=seasons)
+    result = analyze_data((datetimes, flows), config)
+    wet = {stats.block: stats for stats in result if stats.block.endswith('wet')}
+    assert sorted(wet) == ['2021-wet', '2022-wet']
+    assert wet['2021-wet'].max_datetime == '2021-12-01T00:00:00'
+    assert wet['2021-wet'].min_datetime == '2022-01-01T00:00:00'
+    assert wet['2022-wet'].min_datetime == '2023-01-01T00:00:00'
+
+
+@pytest.mark.integration
+def test_api_block_without_duration_windows():
+    datetimes = pd.date_range('2022-01-01', '2022-03-31', freq='15min')
+    flows = np.arange(len(datetimes)) % 97
+    config = HydrographStatsConfig(group_by='month', max_gap='10min')
+    result = analyze_data((datetimes, flows), config)
+    assert [stats.block for stats in result] == ['2022-01', '2022-02', '2022-03']
+    assert all(stats.duration_max is None for stats in result)
+    assert result[1].duration_min_datetime is None
+    assert result[1].max == 96.0
+    result = analyze_data((datetimes, flows), HydrographStatsConfig(max_gap='10min'))
+    assert result[0].duration_max is None
+    assert result[0].duration_min_datetime is None
+    assert result[0].max == 96.0
+
+
+@pytest.mark.integration
+def test_api_usgs_daily_values():
+    rdb = StringIO(
+        '# daily values\n'
+        'agency_cd\tsite_no\tdatetime\t149377_00060_00003\t149377_00060_00003_cd\n'
+        '5s\t15s\t20d\t14n\t10s\n'
+        'USGS\t01646500\t2022-04-01\t12000\tA\n'
+        'USGS\t01646500\t2022-04-02\t30000\tA\n'
+        'USGS\t01646500\t2022-04-03\t22000\tA\n'
+    )
+    df = read_usgs_rdb(rdb)
+    assert list(df.columns) == ['datetime', '149377_00060_00003']
+    result = analyze_data(df, HydrographStatsConfig(duration='2D'))
+    assert result[0].max == pytest.approx(30000.0)
+    assert result[0].max_datetime == '2022-04-02T00:00:00'
+    assert result[0].duration_max == pytest.approx(26000.0)
+
+
+@pytest.mark.integration
+def test_api_usgs_all_codes_qc(tmp_path):
+    path = tmp_path / 'ice.txt'
+    path.write_text(
+        'agency_cd\tsite_no\tdatetime\ttz_cd\t69928_00060\t69928_00060_cd\n'
+        '5s\t15s\t20d\t6s\t14n\t10s\n'
+        'USGS\t01646500\t2022-01-10 00:00\tEST\tIce\tP\n'
+        'USGS\t01646500\t2022-01-10 00:15\tEST\tIce\tP\n'
+        'USGS\t01646500\t2022-01-10 00:30\tEST\tIce\tP\n'
+    )
+    result = main([str(path), '--usgs-rdb', '--qc'])
+    assert result[0]['max'] is None
+    assert result[0]['duration_max'] is None
+    assert result[0]['qc']['rows'] == 3
+    assert result[0]['qc']['non_numeric'] == {'Ice': 3}
+    assert result[0]['qc']['duplicates'] == 0
+
+
+@pytest.mark.integration
+def test_api_limbs_from_lowest_flows():
+    datetimes = pd.Series(pd.date_range('2022-01-01', periods=150, freq='H'))
+    flows = pd.Series(np.concatenate([
+        np.linspace(5, 1, 50), np.linspace(1, 3, 50), np.linspace(3, 100, 50)]))
+    result = hydrograph_extra_stats(
+        datetimes, flows, ['rising_limb_duration', 'falling_limb_duration'])
+    assert result['rising_limb_duration'] == pytest.approx(99 * 3600)
+    assert result['falling_limb_duration'] == 0.0
+    with pytest.raises(ValueError, match='valid flow'):
+        hydrograph_extra_stats(datetimes, flows * np.nan, ['rising_limb_duration'])
+    with pytest.raises(ValueError, match='valid flow'):
+        hydrograph_extra_stats(datetimes, flows * np.nan, ['exceedance'])
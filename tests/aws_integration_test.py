@@ -83,6 +83,31 @@ def test_aws_read_csv():
     assert result[0]['duration_max'] == pytest.approx(47225.0)
 
 
+@pytest.mark.integration
+def test_aws_read_glob():
+    result = main([
+        f's3://{S3_BUCKET}/hydro*.csv',
+        '--storage-options', S3_STORAGE_OPTIONS,
+    ])
+    assert len(result) == 1
+    assert result[0]['hydrograph'] == f's3://{S3_BUCKET}/{HYDROGRAPH_CSV}'
+    assert result[0]['max'] == pytest.approx(47300.0)
+
+
+@pytest.mark.integration
+def test_aws_parse_in_chunks():
+    args = [
+        f's3://{S3_BUCKET}/{HYDROGRAPH_CSV}',
+        '--storage-options', S3_STORAGE_OPTIONS,
+    ]
+    expected = main(args)
+    result = main(args + ['--parse-workers', '2', '--parse-chunk-size', '1000'])
+    for name in ['max_datetime', 'min_datetime', 'duration_max_datetime', 'duration_min_datetime']:
+        assert result[0][name] == expected[0][name]
+    for name in ['max', 'min', 'avg', 'duration_max', 'duration_min']:
+        assert result[0][name] == pytest.approx(expected[0][name])
+
+
 @pytest.mark.integration
 def test_aws_read_usgs_rdb():
     result = main([
@@ -126,6 +151,31 @@ def test_aws_wat_payload():
     key = 'None_hydrograph_stats_R1_E1'
     assert r.get(key) == 'done'
 
+
+@pytest.mark.integration
+def test_aws_wat_payloads():
+    result = main([
+        '--wat-payload', f's3://{S3_BUCKET}/{WAT_PAYLOAD_AWS_YML}', f's3://{S3_BUCKET}/{WAT_PAYLOAD_AWS_YML}',
+        '--wat-payload-fsspec-kwargs', S3_STORAGE_OPTIONS,
+        '--config-fsspec-kwargs', S3_STORAGE_OPTIONS,
+    ])
+    assert len(result) == 2
+    assert result[0]['max'] == pytest.approx(9.447773309400784)
+    assert result[1]['max'] == pytest.approx(9.447773309400784)
+    assert s3_object_exists('results-wat.json')
+
+
+@pytest.mark.integration
+def test_aws_wat_payloads_missing():
+    with pytest.raises(RuntimeError, match='1 of 2 WAT payloads failed'):
+        main([
+            '--wat-payload', f's3://{S3_BUCKET}/missing.yml', f's3://{S3_BUCKET}/{WAT_PAYLOAD_AWS_YML}',
+            '--wat-payload-fsspec-kwargs', S3_STORAGE_OPTIONS,
+            '--config-fsspec-kwargs', S3_STORAGE_OPTIONS,
+        ])
+    assert s3_object_exists('results-wat.json')
+
+
 @pytest.mark.integration
 def test_aws_read_dss():
     result = main([
@@ -53,6 +53,119 @@ def test_redis_read_usgs_rdb():
     assert result[0]['duration_max'] == pytest.approx(47225.0)
 
 
+@pytest.mark.integration
+def test_redis_extra_stats():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        '--stats', 'volume', 'time_to_peak', 'exceedance', 'threshold_duration',
+        '--threshold', '30000',
+    ])
+    assert result[0]['volume'] == pytest.approx(19639350000.0)
+    assert result[0]['time_to_peak'] == pytest.approx(91800.0)
+    assert result[0]['q10'] == pytest.approx(46300.0)
+    assert result[0]['q50'] == pytest.approx(27900.0)
+    assert result[0]['threshold_duration'] == pytest.approx(291600.0)
+
+
+@pytest.mark.integration
+def test_redis_peaks_over_threshold():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        '--pot-threshold', '40000',
+        '--pot-min-separation', '1D',
+    ])
+    assert len(result[0]['events']) == 1
+    assert result[0]['events'][0]['peak'] == pytest.approx(47300.0)
+    assert result[0]['events'][0]['peak_datetime'] == '2022-04-09T01:30:00'
+
+
+@pytest.mark.integration
+def test_redis_group_by():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        '--group-by', 'month',
+    ])
+    assert len(result) == 1
+    assert result[0]['block'] == '2022-04'
+    assert result[0]['max'] == pytest.approx(47300.0)
+    assert result[0]['duration_max'] == pytest.approx(47225.0)
+
+
+@pytest.mark.integration
+def test_redis_qc():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_TXT}',
+        '--usgs-rdb',
+        '--qc',
+        '--max-gap', '1H',
+    ])
+    assert result[0]['max'] == pytest.approx(47300.0)
+    assert result[0]['duration_max'] == pytest.approx(47225.0)
+    assert result[0]['qc']['rows'] == 728
+    assert result[0]['qc']['non_numeric'] == {}
+    assert result[0]['qc']['duplicates'] == 0
+    assert result[0]['qc']['gaps'] == 0
+
+
+@pytest.mark.integration
+def test_redis_parsed_cache(tmp_path):
+    args = [
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HSM1_CSV}',
+        '--parsed-cache', str(tmp_path),
+    ]
+    cold = main(args)
+    assert len(list(tmp_path.glob('*.json'))) == 1
+    warm = main(args)
+    assert warm == cold
+    assert warm[0]['max_datetime'] == '2018-01-01T16:01:01.000000001-05:00'
+
+
+@pytest.mark.integration
+def test_redis_max_workers():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HSM1_CSV}',
+        '--max-workers', '2',
+        '--memory-budget', '1',
+    ])
+    assert result[0]['max'] == pytest.approx(47300.0)
+    assert result[1]['max'] == pytest.approx(9.447773309400784)
+
+
+@pytest.mark.integration
+def test_redis_aggregate():
+    aggregate_out = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#aggregate'
+    main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HSM1_CSV}',
+        '--aggregate-out', aggregate_out,
+    ])
+    main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HSM1_CSV}',
+        '--aggregate-inputs', aggregate_out,
+        '--aggregate-out', f'{aggregate_out}-merged',
+    ])
+    r = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    summary = json.loads(r.get('aggregate-merged'))
+    assert summary['hydrographs'] == 3
+    assert summary['stats']['max']['count'] == 3
+    assert summary['stats']['max']['max'] == pytest.approx(47300.0)
+    assert summary['stats']['max']['percentiles']['p50'] == pytest.approx(9.447773309400784)
+
+
+@pytest.mark.integration
+def test_redis_usgs_all_series():
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_TXT}',
+        '--usgs-rdb',
+        '--usgs-all-series',
+    ])
+    assert len(result) == 1
+    assert result[0]['series'] == '69928_00060'
+    assert result[0]['max'] == pytest.approx(47300.0)
+    assert result[0]['max_datetime'] == '2022-04-09T01:30:00-04:00'
+
+
 @pytest.mark.integration
 def test_redis_out():
     main([
@@ -67,6 +180,33 @@ def test_redis_out():
     assert result[0]['duration_max'] == pytest.approx(47225.0)
 
 
+@pytest.mark.integration
+def test_redis_checkpoint_resume():
+    checkpoint = f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#checkpoint'
+    main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        '--checkpoint', checkpoint,
+    ])
+    r = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    assert r.llen('checkpoint') == 1
+    result = main([
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+        f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HSM1_CSV}',
+        '--checkpoint', checkpoint,
+        '--resume',
+    ])
+    assert r.llen('checkpoint') == 2
+    assert result[0]['max'] == pytest.approx(47300.0)
+    assert result[1]['max'] == pytest.approx(9.447773309400784)
+    with pytest.raises(ValueError):
+        main([
+            f'redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}#{HYDROGRAPH_CSV}',
+            '--checkpoint', checkpoint,
+            '--resume',
+            '--duration', '6H',
+        ])
+
+
 @pytest.mark.integration
 def test_redis_wat_payload():
     main([
@@ -78,3 +218,4 @@ def test_redis_wat_payload():
     assert result[0]['max'] == pytest.approx(9.447773309400784)
     key = 'None_hydrograph_stats_R1_E1'
     assert r.get(key) == 'done'
+    assert not r.exists(f'{key}_checkpoint')